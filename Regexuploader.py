@@ -1,37 +1,73 @@
-import os
-import uuid
 import random
 import json
-import base64
-import string
 import streamlit as st
 import boto3
-import requests
-from urllib.parse import urlparse
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 import re
-from io import BytesIO
-import zipfile
+from image_sources import prepare_image
+from image_probe import fill_tag_dimensions
+from image_variants import DEFAULT_SRCSET_WIDTHS, add_srcsets, build_variants, load_resize_presets, original_object
+from amp_lint import lint_story
+from llm_usage import AccountedLLM, ResponseCache, UsageStore
+from mock_llm import MockLLM
+from story_index import StoryIndex
+from template_registry import TemplateRegistry
+from story_preview import build_page_index, format_size, preview_head, preview_page
+from story_render import (
+    assemble_story_parts,
+    build_story_zip,
+    cleanup_wrapped_urls,
+    encode_parts,
+    extract_story_pages,
+    extract_style,
+    render_template,
+    split_img_tags,
+)
+from upload_spill import SPILL_THRESHOLD, read_upload
 # Load environment variables
 load_dotenv()
 
-# Azure OpenAI client
-client = AzureOpenAI(
-    api_key=st.secrets["AZURE_OPENAI_API_KEY"],
-    azure_endpoint=st.secrets["AZURE_OPENAI_ENDPOINT"],
-    api_version="2025-01-01-preview",
+# Azure OpenAI client (LLM_BACKEND = "mock" for offline runs), recording usage
+# in the same store as app.py so its calls show up in the daily totals
+@st.cache_resource
+def load_llm(backend, usage_db, cache_ttl):
+    if backend == "mock":
+        raw_client = MockLLM(latency=float(st.secrets.get("MOCK_LLM_LATENCY", 0.5)))
+    else:
+        raw_client = AzureOpenAI(
+            api_key=st.secrets["AZURE_OPENAI_API_KEY"],
+            azure_endpoint=st.secrets["AZURE_OPENAI_ENDPOINT"],
+            api_version="2025-01-01-preview",
+        )
+    return AccountedLLM(raw_client, UsageStore(usage_db), ResponseCache(cache_ttl) if cache_ttl else None)
+
+client = load_llm(
+    st.secrets.get("LLM_BACKEND", "azure"),
+    st.secrets.get("LLM_USAGE_DB", "data/llm_usage.sqlite3"),
+    float(st.secrets.get("LLM_CACHE_TTL", 86400)),
 )
 
+
+# Signed-in editor when Streamlit authentication is configured
+def current_editor():
+    return st.user.get("email")
+
 # ----------- AWS S3 config -------------
+# Cover used when no image URL is given or fetching it fails
+DEFAULT_COVER_KEY = "media/default.png"
 aws_access_key = st.secrets["AWS_ACCESS_KEY"]
 aws_secret_key = st.secrets["AWS_SECRET_KEY"]
 region_name = st.secrets["AWS_REGION"]
 bucket_name = st.secrets["AWS_BUCKET"]
 s3_prefix = st.secrets["S3_PREFIX"]
 cdn_base_url = st.secrets["CDN_BASE"]
-cdn_prefix_media = "https://media.suvichaar.org/"
+resize_presets = load_resize_presets(st.secrets.get("RESIZE_PRESETS"))
+srcset_widths = tuple(st.secrets.get("SRCSET_WIDTHS", DEFAULT_SRCSET_WIDTHS))
+# Uploads above this size are spilled to a temp file and memory-mapped
+upload_spill_bytes = int(st.secrets.get("UPLOAD_SPILL_BYTES", SPILL_THRESHOLD))
+upload_spill_dir = st.secrets.get("UPLOAD_SPILL_DIR")
 
 s3_client = boto3.client(
     "s3",
@@ -40,14 +76,25 @@ s3_client = boto3.client(
     region_name=region_name,
 )
 
+# Local story index, shared with app.py so both scripts draw from one uid space
+@st.cache_resource
+def load_story_index(path):
+    return StoryIndex(path)
+
+story_index = load_story_index(st.secrets.get("STORY_INDEX_PATH", "data/story_index.jsonl"))
+
+# Page layouts, shared with app.py
+@st.cache_resource
+def load_template_registry(directory):
+    return TemplateRegistry(directory)
+
+template_registry = load_template_registry(st.secrets.get("TEMPLATES_DIR", "templates"))
+
 # Slug and URL generator
 def generate_slug_and_urls(title):
     if not title or not isinstance(title, str):
         raise ValueError("Invalid title")
-    slug = ''.join(c for c in title.lower().replace(" ", "-").replace("_", "-") if c in string.ascii_lowercase + string.digits + '-')
-    slug = slug.strip('-')
-    nano = ''.join(random.choices(string.ascii_letters + string.digits + '_-', k=10)) + '_G'
-    slug_nano = f"{slug}_{nano}" # this is the urlslug -> slug_nano.html
+    nano, slug_nano = story_index.allocate(title)  # this is the urlslug -> slug_nano.html
     return nano, slug_nano, f"https://suvichaar.org/stories/{slug_nano}", f"https://stories.suvichaar.org/{slug_nano}.html"
 
 # Sidebar Chat
@@ -65,6 +112,10 @@ with st.sidebar:
                     messages=messages,
                     max_tokens=1500,
                     temperature=0.5,
+                    purpose="chat",
+                    editor=current_editor(),
+                    # Asking again should get a fresh answer, not the one from earlier today
+                    use_cache=False,
                 )
                 st.success("Answer:")
                 st.write(response.choices[0].message.content)
@@ -93,6 +144,9 @@ if story_title.strip() and story_title != st.session_state.last_title:
                 messages=messages,
                 max_tokens=150,
                 temperature=0.5,
+                purpose="metadata",
+                editor=current_editor(),
+                story=story_title,
             )
             output = response.choices[0].message.content
             desc = re.search(r"[Dd]escription\s*[:\-]\s*(.+)", output)
@@ -151,8 +205,9 @@ if submit_button:
     st.write(f"**Content Type:** {content_type}")
     st.write(f"**Language:** {language}")
 
-    key_path = "media/default.png"
+    key_path = DEFAULT_COVER_KEY
     uploaded_url = ""
+    image_source = None
 
     try:
         nano, slug_nano, canurl, canurl1 = generate_slug_and_urls(story_title)
@@ -165,43 +220,22 @@ if submit_button:
     # Image URL handling
     if image_url:
 
-        filename = os.path.basename(urlparse(image_url).path)
-        ext = os.path.splitext(filename)[1].lower()
-        if ext not in [".jpg", ".jpeg", ".png", ".gif"]:
-            ext = ".jpg"
-
-        if image_url.startswith("https://stories.suvichaar.org/"):
-
-            uploaded_url = image_url
-            key_path = "/".join(urlparse(image_url).path.split("/")[2:])
-
-        else:
-
-            try:
-                response = requests.get(image_url, timeout=10)
-                response.raise_for_status()
-                unique_filename = f"{uuid.uuid4().hex}{ext}"
-                s3_key = f"{s3_prefix}{unique_filename}"
-                s3_client.put_object(
-                    Bucket=bucket_name,
-                    Key=s3_key,
-                    Body=response.content,
-                    ContentType=response.headers.get("Content-Type", "image/jpeg"),
-                )
-                uploaded_url = f"{cdn_base_url}{s3_key}"
-                key_path = s3_key
+        try:
+            image_source, key_path, uploaded_url = prepare_image(
+                image_url, s3_client, bucket_name, s3_prefix, cdn_base_url
+            )
+            if not image_source.on_cdn:
                 st.success("Image uploaded successfully!")
 
-            except Exception as e:
-                st.warning(f"Failed to fetch/upload image. Using fallback. Error: {e}")
-                uploaded_url = ""
+        except Exception as e:
+            st.warning(f"Failed to fetch/upload image. Using fallback. Error: {e}")
+            image_source = None
+            uploaded_url = ""
     else:
         st.info("No Image URL provided. Using default.")
 
     try:
-        template_path = "templates/masterregex.html"
-        with open(template_path, "r", encoding="utf-8") as file:
-            html_template = file.read()
+        _, compiled_template = template_registry.compiled_for(categories, content_type)
 
 
         user_mapping = {
@@ -227,107 +261,70 @@ if submit_button:
 
         filternumber = category_mapping[categories]
         selected_user = random.choice(list(user_mapping.keys()))
-        html_template = html_template.replace("{{user}}", selected_user)
-        html_template = html_template.replace("{{userprofileurl}}", user_mapping[selected_user])
-        html_template = html_template.replace("{{publishedtime}}", datetime.now(timezone.utc).isoformat(timespec='seconds'))
-        html_template = html_template.replace("{{modifiedtime}}", datetime.now(timezone.utc).isoformat(timespec='seconds'))
-        html_template = html_template.replace("{{storytitle}}", story_title)
-        html_template = html_template.replace("{{metadescription}}", meta_description)
-        html_template = html_template.replace("{{metakeywords}}", meta_keywords)
-        html_template = html_template.replace("{{contenttype}}", content_type)
-        html_template = html_template.replace("{{lang}}", language)
-        html_template = html_template.replace("{{pagetitle}}", page_title)
-        html_template = html_template.replace("{{canurl}}", canurl)
-        html_template = html_template.replace("{{canurl1}}", canurl1)
-
-        if image_url.startswith("http://media.suvichaar.org") or image_url.startswith("https://media.suvichaar.org"):
-    
-            html_template = html_template.replace("{{image0}}", image_url)
-
-        elif image_url.startswith("https://res.cloudinary.com"):
-            # Replace Cloudinary base with our CDN
-            parsed_cloudinary_url = urlparse(image_url)
-            cloudinary_key = parsed_cloudinary_url.path.lstrip("/")
-            key_path = f"media/{os.path.basename(cloudinary_key)}"
-
-            resize_presets = {
-                "potraitcoverurl": (640, 853),
-                "msthumbnailcoverurl": (300, 300),
-            }
-
-            for label, (width, height) in resize_presets.items():
-                template = {
-                    "bucket": bucket_name,
-                    "key": key_path,
-                    "edits": {
-                        "resize": {
-                            "width": width,
-                            "height": height,
-                            "fit": "cover"
-                        }
-                    }
-                }
-                encoded = base64.urlsafe_b64encode(json.dumps(template).encode()).decode()
-                final_url = f"{cdn_prefix_media}{encoded}"
-                html_template = html_template.replace(f"{{{{{label}}}}}", final_url)
-
-            html_template = html_template.replace("{{image0}}", f"{cdn_prefix_media}{key_path}")
-        # ----------- Extract <style amp-custom> block from uploaded raw HTML -------------
-        extracted_style = ""
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        fields = {
+            "user": selected_user,
+            "userprofileurl": user_mapping[selected_user],
+            "publishedtime": now,
+            "modifiedtime": now,
+            "storytitle": story_title,
+            "metadescription": meta_description,
+            "metakeywords": meta_keywords,
+            "contenttype": content_type,
+            "lang": language,
+            "pagetitle": page_title,
+            "canurl": canurl,
+            "canurl1": canurl1,
+            "hreflang": "",
+        }
+
+        if image_source and uploaded_url:
+            fields["image0"] = uploaded_url
+            # An encoded edits URL as cover is resized from its original object
+            original = original_object(key_path, bucket_name)
+            if original:
+                fields.update(build_variants(*original, resize_presets, image_source.variants))
+        else:
+            # No cover, or fetching it failed: the default image and its resizes
+            key_path = DEFAULT_COVER_KEY
+            fields["image0"] = f"{cdn_base_url}{key_path}"
+            fields.update(build_variants(bucket_name, key_path, resize_presets))
+        # Covers the resize service cannot reach (e.g. stories.suvichaar.org) stand in for their own resizes
+        for label in resize_presets:
+            fields.setdefault(label, fields["image0"])
+
+        html_template = cleanup_wrapped_urls(render_template(compiled_template, fields))
+
+        # ----------- Extract <style amp-custom> and slides from uploaded raw HTML -------------
+        extracted_style = b""
+        slide_segments = []
         if html_file:
-            raw_html = html_file.read().decode("utf-8")
+            raw_html = read_upload(html_file, st.session_state, upload_spill_bytes, upload_spill_dir)
 
-            # Extract <style amp-custom> block
-            style_match = re.search(r"(<style\s+amp-custom[^>]*>.*?</style>)", raw_html, re.DOTALL | re.IGNORECASE)
-            if style_match:
-                extracted_style = style_match.group(1)
-            else:
+            extracted_style = extract_style(raw_html)
+            if not extracted_style:
                 st.info("No <style amp-custom> block found in uploaded HTML.")
 
-            # Extract <amp-story> block
-            start = raw_html.find("<amp-story-page")
-            end = raw_html.find("</amp-story>")
-            extracted_amp_story = ""
-            if start != -1 and end != -1:
-                extracted_amp_story = raw_html[start:end + len("</amp-story>")]
+            extracted_amp_story = extract_story_pages(raw_html)
+            if extracted_amp_story:
+                slide_segments = split_img_tags(extracted_amp_story)
+                slide_segments[1::2] = add_srcsets(slide_segments[1::2], bucket_name, srcset_widths)
+                # Intrinsic sizes from the first few KB of each image, to avoid layout shift
+                slide_segments[1::2] = fill_tag_dimensions(slide_segments[1::2])
             else:
                 st.warning("No complete <amp-story> block found in uploaded HTML.")
-        else:
-            extracted_amp_story = ""
-
-        # Insert extracted <style amp-custom> into <head> of your template before </head>
-        if extracted_style:
-            head_close_pos = html_template.lower().find("</head>")
-            if head_close_pos != -1:
-                html_template = (
-                    html_template[:head_close_pos] +
-                    "\n" + extracted_style + "\n" +
-                    html_template[head_close_pos:]
-                )
-            else:
-                st.warning("No </head> tag found in HTML template to insert <style amp-custom>.")
-
-        # Insert extracted AMP story block inside template
-        if extracted_amp_story:
-            # Locate opening <amp-story> tag in template
-            amp_story_opening_match = re.search(r"<amp-story\b[^>]*>", html_template)
-            analytics_tag = '<amp-story-auto-analytics gtag-id="G-2D5GXVRK1E" class="i-amphtml-layout-container" i-amphtml-layout="container"></amp-story-auto-analytics>'
-
-            if amp_story_opening_match and analytics_tag in html_template:
-                insert_pos = amp_story_opening_match.end()
-                # Insert the extracted story slides just after the opening tag, before analytics tag
-                html_template = (
-                    html_template[:insert_pos]
-                    + "\n\n"
-                    + extracted_amp_story
-                    + "\n\n"
-                    + html_template[insert_pos:]
-                )
-            else:
-                st.warning("Could not find insertion points in the HTML template.")
 
-        st.markdown("### Final Modified HTML")
-        st.code(html_template, language="html")
+        story_parts, insertion_warnings = assemble_story_parts(html_template, extracted_style, slide_segments)
+        for warning in insertion_warnings:
+            st.warning(warning)
+        html_body = encode_parts(story_parts)
+
+        lint_report = lint_story(html_body)
+        if lint_report["errors"]:
+            st.error(f"AMP lint found {lint_report['errors']} error(s); fix them before publishing this bundle.")
+        if lint_report["issues"]:
+            with st.expander("AMP lint report", expanded=bool(lint_report["errors"])):
+                st.dataframe(lint_report["issues"])
 
         # ----------- Generate and Provide Metadata JSON -------------
         metadata_dict = {
@@ -348,22 +345,48 @@ if submit_button:
 
         json_str = json.dumps(metadata_dict, indent=4)
 
-        # Save data to session_state
-        zip_buffer = BytesIO()
+        zip_buffer = build_story_zip(slug_nano, html_body, json_str)
 
-        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-            zip_file.writestr(f"{slug_nano}.html", html_template)
-            zip_file.writestr(f"{slug_nano}_metadata.json", json_str)
-        
-        zip_buffer.seek(0)
-
-        st.download_button(
-            label="📦 Download HTML + Metadata ZIP",
-            data=zip_buffer,
-            file_name=f"{slug_nano}_story_bundle.zip",
-            mime="application/zip"
-        )
+        # Kept across reruns so paging through the preview does not lose the result
+        st.session_state.story_output = {
+            "slug_nano": slug_nano,
+            "html": html_body,
+            "index": build_page_index(html_body),
+            "zip": zip_buffer.getvalue(),
+        }
+        st.session_state.preview_page = 0
 
     except Exception as e:
         st.error(f"Error processing HTML: {e}")
 
+# ----------- Preview and download of the last generated story -------------
+# One slide at a time from a byte-offset index, <style> bodies collapsed, each view
+# clipped, so the preview costs the same for a 5-page and a 500-page story
+if "story_output" in st.session_state:
+    story_output = st.session_state.story_output
+    page_index = story_output["index"]
+
+    st.markdown("### Final Modified HTML")
+    st.caption(f"{len(page_index['pages'])} pages, {format_size(page_index['size'])}")
+    page_number = st.number_input(
+        "Preview page (0 = document head)",
+        min_value=0,
+        max_value=len(page_index["pages"]),
+        step=1,
+        key="preview_page",
+    )
+    if page_number:
+        preview_text, truncated = preview_page(story_output["html"], page_index, page_number)
+        st.caption(f"Page id: {page_index['pages'][page_number - 1]['id']}")
+    else:
+        preview_text, truncated = preview_head(story_output["html"], page_index)
+    st.code(preview_text, language="html")
+    if truncated:
+        st.caption("Preview clipped; download the ZIP for the full document.")
+
+    st.download_button(
+        label="📦 Download HTML + Metadata ZIP",
+        data=story_output["zip"],
+        file_name=f"{story_output['slug_nano']}_story_bundle.zip",
+        mime="application/zip"
+    )
@@ -0,0 +1,251 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# A practical subset of the AMP story rules, checked on the rendered (encoded) document
+# before upload. Pages are linted on their own and cached by content hash, so an edit
+# only re-checks the pages that changed.
+
+PAGE_OPEN = b"<amp-story-page"
+PAGE_CLOSE = b"</amp-story-page>"
+CUSTOM_CSS_LIMIT = 75000
+AMP_CDN = b"https://cdn.ampproject.org/"
+
+# One alternation so every region is tokenised in a single regex scan
+TOKEN_RE = re.compile(
+    rb"<(/?)(html|head|meta|link|script|style|amp-story-page|amp-story-grid-layer|amp-story|amp-img|img|video|audio|iframe)"
+    rb"(?=[\s/>])([^>]*)>"
+    rb"|\{\{(\w+)\}\}",
+    re.IGNORECASE,
+)
+PLACEHOLDER_RE = re.compile(rb"\{\{(\w+)\}\}")
+ATTR_RE = re.compile(rb'([\w:-]+)(?:\s*=\s*"([^"]*)")?')
+STYLE_CLOSE_RE = re.compile(rb"</style>", re.IGNORECASE)
+SCRIPT_CLOSE_RE = re.compile(rb"</script>", re.IGNORECASE)
+
+REQUIRED_STORY_ATTRS = ("standalone", "title", "publisher", "publisher-logo-src", "poster-portrait-src")
+ALLOWED_INLINE_SCRIPTS = (b"application/ld+json", b"application/json")
+ALLOWED_SCRIPT_ATTRS = (b"amp-onerror", b"amp-story-dvh-polyfill")
+DISALLOWED_TAGS = {b"img": "amp-img", b"video": "amp-video", b"audio": "amp-audio", b"iframe": "amp-iframe"}
+SIZELESS_LAYOUTS = (b"fill", b"nodisplay", b"flex-item")
+# Server-side rendered AMP (transformed="self;v=1") puts the runtime's own <img>
+# inside <amp-img> and <i-amphtml-sizer>; those carry an i-amphtml- class
+AMP_RUNTIME_CLASS_RE = re.compile(rb"(?:^|\s)i-amphtml-")
+
+CACHE_SIZE = 4096
+_page_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class LintFailed(Exception):
+    pass
+
+
+def _attrs(raw):
+    return {name.lower(): value for name, value in ATTR_RE.findall(raw)}
+
+
+def _issue(level, rule, message, page=None):
+    return {"level": level, "rule": rule, "message": message, "page": page}
+
+
+def _runtime_img(raw):
+    return bool(AMP_RUNTIME_CLASS_RE.search(_attrs(raw).get(b"class", b"")))
+
+
+# Issues for one page (bytes), without the page number; cached by content hash
+def _lint_page(page):
+    issues = []
+    opening = TOKEN_RE.match(page)
+    page_id = _attrs(opening.group(3)).get(b"id") if opening else None
+    if not page_id:
+        issues.append(_issue("error", "page-id", "<amp-story-page> needs an id"))
+    layers = 0
+    amp_img_depth = 0
+    for match in TOKEN_RE.finditer(page, opening.end() if opening else 0):
+        if match.group(4):
+            issues.append(_issue("error", "placeholder", f"Unfilled placeholder {{{{{match.group(4).decode()}}}}}"))
+            continue
+        if match.group(1):
+            if match.group(2).lower() == b"amp-img":
+                amp_img_depth = max(amp_img_depth - 1, 0)
+            continue
+        # Placeholders inside attribute values are consumed with their tag
+        for name in PLACEHOLDER_RE.findall(match.group(3)):
+            issues.append(_issue("error", "placeholder", f"Unfilled placeholder {{{{{name.decode()}}}}}"))
+        tag = match.group(2).lower()
+        if tag == b"amp-story-grid-layer":
+            layers += 1
+        elif tag == b"amp-story-page":
+            issues.append(_issue("error", "nested-page", "<amp-story-page> inside another page"))
+        elif tag == b"img" and (amp_img_depth or _runtime_img(match.group(3))):
+            continue
+        elif tag in DISALLOWED_TAGS:
+            issues.append(_issue("error", "disallowed-tag", f"<{tag.decode()}> is not allowed, use <{DISALLOWED_TAGS[tag]}>"))
+        elif tag == b"script":
+            attrs = _attrs(match.group(3))
+            if attrs.get(b"type") not in ALLOWED_INLINE_SCRIPTS:
+                issues.append(_issue("error", "custom-script", "Custom JavaScript is not allowed in AMP"))
+        elif tag == b"amp-img":
+            if not match.group(3).rstrip().endswith(b"/"):
+                amp_img_depth += 1
+            attrs = _attrs(match.group(3))
+            if not attrs.get(b"src") and not attrs.get(b"srcset"):
+                issues.append(_issue("error", "amp-img-src", "<amp-img> without src"))
+            if attrs.get(b"layout") not in SIZELESS_LAYOUTS and not (attrs.get(b"width") and attrs.get(b"height")):
+                issues.append(_issue("error", "amp-img-size", '<amp-img> needs width and height, or layout="fill"'))
+    if not layers:
+        issues.append(_issue("error", "grid-layer", "Page has no <amp-story-grid-layer>"))
+    return (page_id.decode("utf-8", "replace") if page_id else None), issues
+
+
+def _cached_page(page):
+    key = hashlib.blake2b(page, digest_size=16).digest()
+    with _cache_lock:
+        hit = _page_cache.get(key)
+        if hit is not None:
+            _page_cache.move_to_end(key)
+            return hit, True
+    result = _lint_page(bytes(page))
+    with _cache_lock:
+        _page_cache[key] = result
+        if len(_page_cache) > CACHE_SIZE:
+            _page_cache.popitem(last=False)
+    return result, False
+
+
+# Document-level rules over everything outside the pages (head, story shell)
+def _lint_shell(html, regions, issues):
+    seen = {}
+    custom_css = 0
+    story_tags = []
+    placeholders = set()
+    for start, end in regions:
+        pos = start
+        while True:
+            match = TOKEN_RE.search(html, pos, end)
+            if not match:
+                break
+            pos = match.end()
+            if match.group(4):
+                placeholders.add(match.group(4).decode())
+                continue
+            tag = match.group(2).lower()
+            if match.group(1):
+                seen[b"/" + tag] = seen.get(b"/" + tag, 0) + 1
+                continue
+            seen[tag] = seen.get(tag, 0) + 1
+            raw = match.group(3)
+            # Placeholders inside attribute values are consumed with their tag
+            placeholders.update(name.decode() for name in PLACEHOLDER_RE.findall(raw))
+            if tag == b"html":
+                attrs = _attrs(raw)
+                if b"amp" not in attrs and "⚡".encode() not in raw:
+                    issues.append(_issue("error", "html-amp", '<html> needs the "amp" attribute'))
+            elif tag == b"meta":
+                attrs = _attrs(raw)
+                if attrs.get(b"charset", b"").lower() == b"utf-8":
+                    seen[b"charset"] = 1
+                if attrs.get(b"name") == b"viewport":
+                    seen[b"viewport"] = 1
+            elif tag == b"link":
+                if _attrs(raw).get(b"rel") == b"canonical":
+                    seen[b"canonical"] = 1
+            elif tag == b"style":
+                closing = STYLE_CLOSE_RE.search(html, pos, end)
+                if b"amp-custom" in raw:
+                    seen[b"amp-custom"] = seen.get(b"amp-custom", 0) + 1
+                    custom_css += (closing.start() if closing else end) - pos
+                if b"amp-boilerplate" in raw:
+                    seen[b"amp-boilerplate"] = 1
+                # CSS is never tokenised
+                pos = closing.end() if closing else end
+            elif tag == b"script":
+                attrs = _attrs(raw)
+                src = attrs.get(b"src") or b""
+                if src.startswith(AMP_CDN):
+                    if src.endswith((b"/v0.js", b"/v0.mjs")):
+                        seen[b"runtime"] = 1
+                    if attrs.get(b"custom-element") == b"amp-story":
+                        seen[b"amp-story-script"] = 1
+                elif attrs.get(b"type") not in ALLOWED_INLINE_SCRIPTS and not any(a in attrs for a in ALLOWED_SCRIPT_ATTRS):
+                    issues.append(_issue("error", "custom-script", "Custom JavaScript is not allowed in AMP"))
+                closing = SCRIPT_CLOSE_RE.search(html, pos, end)
+                pos = closing.end() if closing else end
+            elif tag == b"amp-story":
+                story_tags.append(_attrs(raw))
+            elif tag in DISALLOWED_TAGS and not (tag == b"img" and _runtime_img(raw)):
+                issues.append(_issue("error", "disallowed-tag", f"<{tag.decode()}> is not allowed, use <{DISALLOWED_TAGS[tag]}>"))
+
+    if not seen.get(b"head") or not seen.get(b"/head"):
+        issues.append(_issue("error", "head", "Missing <head> or </head>"))
+    for key, rule, message in (
+        (b"charset", "charset", 'Missing <meta charset="utf-8">'),
+        (b"viewport", "viewport", "Missing viewport <meta>"),
+        (b"canonical", "canonical", 'Missing <link rel="canonical">'),
+        (b"runtime", "runtime", "Missing the AMP runtime script"),
+        (b"amp-story-script", "amp-story-script", "Missing the amp-story extension script"),
+        (b"amp-boilerplate", "boilerplate", "Missing <style amp-boilerplate>"),
+    ):
+        if not seen.get(key):
+            issues.append(_issue("error", rule, message))
+    if seen.get(b"amp-custom", 0) > 1:
+        issues.append(_issue("error", "amp-custom", "More than one <style amp-custom>"))
+    if custom_css > CUSTOM_CSS_LIMIT:
+        issues.append(_issue("error", "amp-custom-size", f"<style amp-custom> is {custom_css} bytes, AMP allows {CUSTOM_CSS_LIMIT}"))
+    if len(story_tags) != 1:
+        issues.append(_issue("error", "amp-story", f"Expected one <amp-story>, found {len(story_tags)}"))
+    else:
+        for attr in REQUIRED_STORY_ATTRS:
+            if attr.encode() not in story_tags[0] or (attr != "standalone" and not story_tags[0][attr.encode()]):
+                issues.append(_issue("error", "amp-story-attrs", f'<amp-story> needs a "{attr}" attribute'))
+    for name in sorted(placeholders):
+        issues.append(_issue("error", "placeholder", f"Unfilled placeholder {{{{{name}}}}}"))
+
+
+# Lint a rendered story (bytes). Returns {"issues", "errors", "pages", "cached_pages", "seconds"}.
+def lint_story(html):
+    started = time.perf_counter()
+    issues = []
+    shell = []
+    pages = []
+    pos = 0
+    while True:
+        start = html.find(PAGE_OPEN, pos)
+        if start == -1:
+            break
+        end = html.find(PAGE_CLOSE, start)
+        if end == -1:
+            issues.append(_issue("error", "page-close", "<amp-story-page> without </amp-story-page>", len(pages) + 1))
+            break
+        end += len(PAGE_CLOSE)
+        shell.append((pos, start))
+        pages.append((start, end))
+        pos = end
+    shell.append((pos, len(html)))
+
+    _lint_shell(html, shell, issues)
+
+    view = memoryview(html)
+    cached = 0
+    ids = {}
+    for number, (start, end) in enumerate(pages, 1):
+        (page_id, page_issues), hit = _cached_page(view[start:end])
+        cached += hit
+        issues.extend(dict(issue, page=number) for issue in page_issues)
+        if page_id in ids:
+            issues.append(_issue("error", "duplicate-id", f'Page id "{page_id}" also used by page {ids[page_id]}', number))
+        elif page_id:
+            ids[page_id] = number
+    if not pages:
+        issues.append(_issue("error", "no-pages", "The story has no <amp-story-page>"))
+
+    return {
+        "issues": issues,
+        "errors": sum(issue["level"] == "error" for issue in issues),
+        "pages": len(pages),
+        "cached_pages": cached,
+        "seconds": round(time.perf_counter() - started, 6),
+    }
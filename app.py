@@ -1,53 +1,197 @@
-import os
-import uuid
 import random
 import json
-import base64
-import string
 import streamlit as st
 import boto3
-import requests
-from urllib.parse import urlparse
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 import re
-from io import BytesIO
-import zipfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from amp_lint import LintFailed, lint_story
+from near_duplicates import DUPLICATE_THRESHOLD, DuplicateIndex, signature_for_pages
+from story_index import StoryIndex
+from story_search import StorySearch
+from tag_vocabulary import TagVocabulary, tag_key
+from template_registry import TemplateRegistry
+from metadata_feed import COMPACT_EVERY, MetadataFeed
+from image_sources import MEDIA_CDN, external_media_urls, prepare_image
+from media_rehost import abort_stale_uploads, media_extension, rehost_media, rewrite_media_urls
+from http_client import HOST_LATENCY, Deadline
+from llm_usage import AccountedLLM, ResponseCache, UsageStore
+from local_s3 import LocalS3Client
+from mock_llm import MockLLM
+from cdn_prewarm import collect_variant_urls, start_prewarm
+from image_probe import fill_tag_dimensions
+from local_variants import generate_variants_batch, upload_variants
+from image_variants import DEFAULT_SRCSET_WIDTHS, add_srcsets, build_variants, load_resize_presets, original_object
+from pipeline_timing import PipelineTimer, start_metrics_server
+from story_render import (
+    assemble_story_parts,
+    build_bundle_zip,
+    changed_fields,
+    cleanup_wrapped_urls,
+    encode_parts,
+    extract_story_pages,
+    extract_style,
+    hreflang_links,
+    render_template,
+    split_img_tags,
+)
+from upload_spill import SPILL_THRESHOLD, read_upload
 # Load environment variables
 load_dotenv()
 
-# Azure OpenAI client
-client = AzureOpenAI(
-    api_key=st.secrets["AZURE_OPENAI_API_KEY"],
-    azure_endpoint=st.secrets["AZURE_OPENAI_ENDPOINT"],
-    api_version="2025-01-01-preview",
+# Azure OpenAI client (LLM_BACKEND = "mock" for offline runs), with every call's
+# tokens and latency recorded per day and identical requests answered from cache
+@st.cache_resource
+def load_llm(backend, usage_db, cache_ttl):
+    if backend == "mock":
+        raw_client = MockLLM(latency=float(st.secrets.get("MOCK_LLM_LATENCY", 0.5)))
+    else:
+        raw_client = AzureOpenAI(
+            api_key=st.secrets["AZURE_OPENAI_API_KEY"],
+            azure_endpoint=st.secrets["AZURE_OPENAI_ENDPOINT"],
+            api_version="2025-01-01-preview",
+        )
+    return AccountedLLM(raw_client, UsageStore(usage_db), ResponseCache(cache_ttl) if cache_ttl else None)
+
+client = load_llm(
+    st.secrets.get("LLM_BACKEND", "azure"),
+    st.secrets.get("LLM_USAGE_DB", "data/llm_usage.sqlite3"),
+    float(st.secrets.get("LLM_CACHE_TTL", 86400)),
 )
 
+
+# Signed-in editor when Streamlit authentication is configured
+def current_editor():
+    return st.user.get("email")
+
 # ----------- AWS S3 config -------------
-aws_access_key = st.secrets["AWS_ACCESS_KEY"]
-aws_secret_key = st.secrets["AWS_SECRET_KEY"]
-region_name = st.secrets["AWS_REGION"]
+# Cover used when no image URL is given or fetching it fails
+DEFAULT_COVER_KEY = "media/default.png"
 bucket_name = st.secrets["AWS_BUCKET"]
 s3_prefix = st.secrets["S3_PREFIX"]
 cdn_base_url = st.secrets["CDN_BASE"]
-cdn_prefix_media = "https://media.suvichaar.org/"
+resize_presets = load_resize_presets(st.secrets.get("RESIZE_PRESETS"))
+srcset_widths = tuple(st.secrets.get("SRCSET_WIDTHS", DEFAULT_SRCSET_WIDTHS))
+use_local_variants = bool(st.secrets.get("LOCAL_VARIANTS", False))
+prewarm_concurrency = int(st.secrets.get("PREWARM_CONCURRENCY", 8))
+prewarm_budget = float(st.secrets.get("PREWARM_BUDGET_SECONDS", 20))
+memory_report = bool(st.secrets.get("MEMORY_REPORT", False))
+# AMP lint errors stop the upload unless this is turned off
+lint_blocking = bool(st.secrets.get("AMP_LINT_BLOCKING", True))
+# Uploads above this size are spilled to a temp file and memory-mapped
+upload_spill_bytes = int(st.secrets.get("UPLOAD_SPILL_BYTES", SPILL_THRESHOLD))
+upload_spill_dir = st.secrets.get("UPLOAD_SPILL_DIR")
+# External videos and other media in the slides are copied into the bucket; large
+# files go up as resumable multipart uploads tracked under this directory
+rehost_slide_media = bool(st.secrets.get("REHOST_SLIDE_MEDIA", True))
+media_rehost_state_dir = st.secrets.get("MEDIA_REHOST_STATE_DIR", "data/rehost")
+# Overall time for the cover fetch and image probes of one submit; a slow origin
+# uses up this budget instead of a fixed 10 s per request
+fetch_budget = float(st.secrets.get("FETCH_BUDGET_SECONDS", 15))
+# Send a second GET when the first has not answered after this many seconds ("auto": the host's p95)
+fetch_hedge_after = st.secrets.get("FETCH_HEDGE_AFTER")
+if fetch_hedge_after not in (None, "auto"):
+    fetch_hedge_after = float(fetch_hedge_after)
+# Slide-text similarity (estimated Jaccard of word 3-grams) above which a story is flagged as a near-duplicate
+duplicate_threshold = float(st.secrets.get("NEAR_DUPLICATE_THRESHOLD", DUPLICATE_THRESHOLD))
+
+# One client per process, shared by every session (S3_BACKEND = "local" keeps
+# objects under S3_LOCAL_ROOT, or in memory, for offline runs and load tests)
+@st.cache_resource
+def load_s3_client(backend, local_root):
+    if backend == "local":
+        return LocalS3Client(local_root)
+    return boto3.client(
+        "s3",
+        aws_access_key_id=st.secrets["AWS_ACCESS_KEY"],
+        aws_secret_access_key=st.secrets["AWS_SECRET_KEY"],
+        region_name=st.secrets["AWS_REGION"],
+    )
+
+s3_client = load_s3_client(st.secrets.get("S3_BACKEND", "aws"), st.secrets.get("S3_LOCAL_ROOT"))
+
+# Local index of published stories, used to update a story in place
+@st.cache_resource
+def load_story_index(path):
+    return StoryIndex(path)
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=aws_access_key,
-    aws_secret_access_key=aws_secret_key,
-    region_name=region_name,
+story_index = load_story_index(st.secrets.get("STORY_INDEX_PATH", "data/story_index.jsonl"))
+
+# Search over published stories, kept current by the story index on every publish
+@st.cache_resource
+def load_story_search(_story_index, snapshot_path):
+    return StorySearch(_story_index, snapshot_path)
+
+story_search = load_story_search(story_index, st.secrets.get("STORY_SEARCH_SNAPSHOT", "data/story_search.pickle"))
+
+# MinHash signatures of published slide text, for the near-duplicate check
+@st.cache_resource
+def load_duplicate_index(path):
+    return DuplicateIndex(path)
+
+duplicate_index = load_duplicate_index(st.secrets.get("NEAR_DUPLICATES_PATH", "data/near_duplicates.bin"))
+
+# Filter tags of published stories, for autocomplete and spelling normalisation
+@st.cache_resource
+def load_tag_vocabulary(_story_index):
+    return TagVocabulary(_story_index)
+
+tag_vocabulary = load_tag_vocabulary(story_index)
+
+# NDJSON + columnar feed of every publish's metadata, for bulk downstream ingestion
+@st.cache_resource
+def load_metadata_feed(_story_index, directory, compact_every):
+    feed = MetadataFeed(directory, compact_every)
+    if feed.is_empty():
+        feed.backfill(_story_index.entries())
+    _story_index.listeners.append(feed.append)
+    return feed
+
+metadata_feed = load_metadata_feed(
+    story_index,
+    st.secrets.get("METADATA_FEED_DIR", "data/feed"),
+    int(st.secrets.get("METADATA_FEED_COMPACT_EVERY", COMPACT_EVERY)),
 )
 
+# Page layouts, composed from shared partials and compiled once per process
+@st.cache_resource
+def load_template_registry(directory):
+    return TemplateRegistry(directory)
+
+template_registry = load_template_registry(st.secrets.get("TEMPLATES_DIR", "templates"))
+
+# Prometheus-style /metrics endpoint with per-stage timings, started once per process
+@st.cache_resource
+def start_metrics_endpoint(port):
+    return start_metrics_server(port)
+
+if st.secrets.get("METRICS_PORT"):
+    start_metrics_endpoint(int(st.secrets["METRICS_PORT"]))
+
+# Shared pool for uploading the language variants of a story concurrently
+@st.cache_resource
+def get_s3_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="s3-put")
+
+s3_executor = get_s3_executor()
+
+# Multipart media uploads abandoned for a day are aborted in the background, at most hourly per process
+@st.cache_resource(ttl=3600)
+def sweep_stale_uploads(bucket, prefix, state_dir):
+    return s3_executor.submit(abort_stale_uploads, s3_client, bucket, prefix, state_dir)
+
+if rehost_slide_media:
+    sweep_stale_uploads(bucket_name, s3_prefix, media_rehost_state_dir)
+
 # Slug and URL generator
 def generate_slug_and_urls(title):
     if not title or not isinstance(title, str):
         raise ValueError("Invalid title")
-    slug = ''.join(c for c in title.lower().replace(" ", "-").replace("_", "-") if c in string.ascii_lowercase + string.digits + '-')
-    slug = slug.strip('-')
-    nano = ''.join(random.choices(string.ascii_letters + string.digits + '_-', k=10)) + '_G'
-    slug_nano = f"{slug}_{nano}" # this is the urlslug -> slug_nano.html
+    nano, slug_nano = story_index.allocate(title)  # this is the urlslug -> slug_nano.html
     return nano, slug_nano, f"https://suvichaar.org/stories/{slug_nano}", f"https://stories.suvichaar.org/{slug_nano}.html"
 
 # Sidebar Chat
@@ -65,10 +209,41 @@ with st.sidebar:
                     messages=messages,
                     max_tokens=1500,
                     temperature=0.5,
+                    purpose="chat",
+                    editor=current_editor(),
+                    # Asking again should get a fresh answer, not the one from earlier today
+                    use_cache=False,
                 )
                 st.success("Answer:")
                 st.write(response.choices[0].message.content)
 
+    st.header("Search published stories")
+    search_query = st.text_input("Title, keyword or tag", help='Filter with lang:hi, cat:21, tag:music or tag:"indian railways"')
+    if search_query.strip():
+        found = story_search.search(search_query)
+        st.caption(f"{found['total']} matches in {found['ms']:.2f} ms")
+        if found["results"]:
+            st.dataframe(
+                [{"title": doc["title"], "slug": doc["slug_nano"], "lang": doc["lang"], "tags": doc["tags"], "url": doc["url"]}
+                 for doc in found["results"]],
+                hide_index=True,
+            )
+
+    llm_usage = client.store.daily()
+    if llm_usage:
+        with st.expander("LLM usage, last 7 days"):
+            st.dataframe(llm_usage, hide_index=True)
+
+    story_usage = client.store.by_story()
+    if story_usage:
+        with st.expander("LLM usage by story, today"):
+            st.dataframe(story_usage, hide_index=True)
+
+    fetch_latency = HOST_LATENCY.snapshot()
+    if fetch_latency:
+        with st.expander("Image fetch latency by host"):
+            st.dataframe(fetch_latency, hide_index=True)
+
 # Content Submission Form
 st.title("Content Submission Form")
 if "last_title" not in st.session_state:
@@ -76,8 +251,35 @@ if "last_title" not in st.session_state:
     st.session_state.meta_description = ""
     st.session_state.meta_keywords = ""
 
+# Update-in-place mode: look up a published story and overwrite its key
+mode = st.radio("Mode", ("Publish new story", "Update existing story"), horizontal=True)
+existing_story = None
+if mode == "Update existing story":
+    existing_lookup = st.text_input("Existing story slug, uid or URL")
+    if existing_lookup.strip():
+        existing_story = story_index.get(existing_lookup)
+        if existing_story is None:
+            st.warning("No published story found for that slug or uid.")
+        else:
+            st.info(f"Editing **{existing_story['slug_nano']}**, first published {existing_story['publishedtime']}")
+            # Prefill once per story so the stored title does not trigger a new LLM call
+            if st.session_state.get("editing_slug") != existing_story["slug_nano"]:
+                st.session_state.editing_slug = existing_story["slug_nano"]
+                st.session_state.last_title = existing_story["fields"]["storytitle"]
+                st.session_state.meta_description = existing_story["fields"]["metadescription"]
+                st.session_state.meta_keywords = existing_story["fields"]["metakeywords"]
+                st.session_state.generated_filter_tags = ", ".join(existing_story["metadata"]["filterTags"])
+
 # Title input outside form for dynamic update
-story_title = st.text_input("Story Title")
+story_title = st.text_input("Story Title", value=existing_story["fields"]["storytitle"] if existing_story else "")
+
+languages = ["en-US", "hi"]
+# Extra language variants of a new story, rendered and published in the same submit
+extra_languages = [] if existing_story else st.multiselect(
+    "Also publish in",
+    languages,
+    help="Each extra language gets its own title and slides; all variants share the metadata and cover image and link to each other with hreflang.",
+)
 
 # Auto-generate metadata if story_title changed
 
@@ -93,54 +295,90 @@ if story_title.strip() and story_title != st.session_state.last_title:
                 3. Relevant filter tags (comma separated, suitable for categorization and content filtering)"""
             }
         ]
+        metadata_timer = PipelineTimer("metadata")
         try:
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                max_tokens=300,
-                temperature=0.5,
-            )
-            output = response.choices[0].message.content
+            with metadata_timer.span("llm") as span:
+                response = client.chat.completions.create(
+                    model="gpt-4",
+                    messages=messages,
+                    max_tokens=300,
+                    temperature=0.5,
+                    purpose="metadata",
+                    editor=current_editor(),
+                    story=story_title,
+                )
+                output = response.choices[0].message.content
+                span["bytes"] = len(output.encode("utf-8"))
 
             # Extract metadata using regex
-            desc = re.search(r"[Dd]escription\s*[:\-]\s*(.+)", output)
-            keys = re.search(r"[Kk]eywords\s*[:\-]\s*(.+)", output)
-            tags = re.search(r"[Ff]ilter\s*[Tt]ags\s*[:\-]\s*(.+)", output)
+            with metadata_timer.span("parse"):
+                desc = re.search(r"[Dd]escription\s*[:\-]\s*(.+)", output)
+                keys = re.search(r"[Kk]eywords\s*[:\-]\s*(.+)", output)
+                tags = re.search(r"[Ff]ilter\s*[Tt]ags\s*[:\-]\s*(.+)", output)
 
             st.session_state.meta_description = desc.group(1).strip() if desc else ""
             st.session_state.meta_keywords = keys.group(1).strip() if keys else ""
-            st.session_state.generated_filter_tags = tags.group(1).strip() if tags else ""
+            st.session_state.generated_filter_tags = ", ".join(tag_vocabulary.parse(tags.group(1))) if tags else ""
 
         except Exception as e:
             st.warning(f"Error: {e}")
+        st.session_state.metadata_timing = metadata_timer.finish(title=story_title)
         st.session_state.last_title = story_title
 
+if st.session_state.get("metadata_timing"):
+    with st.expander("⏱ Metadata generation timings"):
+        st.dataframe(st.session_state.metadata_timing["spans"])
+
+default_tags = [
+    "Lata Mangeshkar",
+    "Indian Music Legends",
+    "Playback Singing",
+    "Bollywood Golden Era",
+    "Indian Cinema",
+    "Musical Icons",
+    "Voice of India",
+    "Bharat Ratna",
+    "Indian Classical Music",
+    "Hindi Film Songs",
+    "Legendary Singers",
+    "Cultural Heritage",
+    "Suvichaar Stories"
+]
+
+# Tag lookup: completes from the tags of published stories and adds the picked one
+tag_lookup = st.text_input("Find a filter tag", help="Suggests tags already used on published stories, most used first.")
+if tag_lookup.strip():
+    suggestions = dict(tag_vocabulary.complete(tag_lookup))
+    if suggestions:
+        picked_tag = st.pills(
+            "Add to filter tags", list(suggestions), format_func=lambda tag: f"{tag} ({suggestions[tag]})",
+            key=f"tag_pick_{tag_key(tag_lookup)}",
+        )
+        if picked_tag:
+            current_tags = tag_vocabulary.parse(st.session_state.get("generated_filter_tags", ", ".join(default_tags)))
+            if tag_key(picked_tag) not in {tag_key(tag) for tag in current_tags}:
+                st.session_state.generated_filter_tags = ", ".join(current_tags + [picked_tag])
+    else:
+        st.caption("No published story uses a matching tag yet.")
 
 with st.form("content_form"):
     meta_description = st.text_area("Meta Description", value=st.session_state.meta_description)
     meta_keywords = st.text_input("Meta Keywords (comma separated)", value=st.session_state.meta_keywords)
     content_type = st.selectbox("Select your contenttype", ["News", "Article"])
-    language = st.selectbox("Select your Language", ["en-US", "hi"])
-    image_url = st.text_input("Enter your Image URL")
-    html_file = st.file_uploader("Upload your Raw HTML File", type=["html", "htm"])
+    language = st.selectbox("Select your Language", languages)
+    image_url = st.text_input("Enter your Image URL", value=existing_story["image_url"] if existing_story else "")
+    html_file = st.file_uploader(
+        "Upload your Raw HTML File",
+        type=["html", "htm"],
+        help="When updating a story, leave empty to keep the published slides.",
+    )
+    variant_inputs = {}
+    for variant_lang in extra_languages:
+        variant_inputs[variant_lang] = (
+            st.text_input(f"Story Title ({variant_lang})"),
+            st.file_uploader(f"Raw HTML File ({variant_lang})", type=["html", "htm"]),
+        )
     categories = st.selectbox("Select your Categories", ["Art", "Travel", "Entertainment", "Literature", "Books", "Sports", "History", "Culture", "Wildlife", "Spiritual", "Food"])
-    # Input field
-    default_tags = [
-        "Lata Mangeshkar",
-        "Indian Music Legends",
-        "Playback Singing",
-        "Bollywood Golden Era",
-        "Indian Cinema",
-        "Musical Icons",
-        "Voice of India",
-        "Bharat Ratna",
-        "Indian Classical Music",
-        "Hindi Film Songs",
-        "Legendary Singers",
-        "Cultural Heritage",
-        "Suvichaar Stories"
-    ]
-
     tag_input = st.text_input(
         "Enter Filter Tags (comma separated):",
         value=st.session_state.get("generated_filter_tags", ", ".join(default_tags)),
@@ -153,6 +391,11 @@ with st.form("content_form"):
         cover_image_url = st.text_input("Enter your custom Cover Image URL")
     else:
         cover_image_url = image_url  # fallback to image_url
+    prewarm_cdn = st.checkbox(
+        "Prewarm CDN image variants after publish",
+        value=st.secrets.get("PREWARM_CDN", False),
+        help="Requests every resized image once so the first reader does not pay the cold-cache resize.",
+    )
     # Select a user randomly and map to profile URL
     submit_button = st.form_submit_button("Submit")
 
@@ -176,7 +419,7 @@ if submit_button:
         missing_fields.append("Filter Tags")
     if not categories.strip():
         missing_fields.append("Category")
-    if not html_file:
+    if not html_file and not existing_story:
         missing_fields.append("Raw HTML File")
 
     if missing_fields:
@@ -190,232 +433,415 @@ if submit_button:
         st.write(f"**Content Type:** {content_type}")
         st.write(f"**Language:** {language}")
 
-    key_path = "media/default.png"
-    uploaded_url = ""
-
-    try:
-        nano, slug_nano, canurl, canurl1 = generate_slug_and_urls(story_title)
-        page_title = f"{story_title} | Suvichaar"
-    except Exception as e:
-
-        st.error(f"Error generating canonical URLs: {e}")
-        nano = slug_nano = canurl = canurl1 = page_title = ""
-
-    # Image URL handling
-    if image_url:
+    with PipelineTimer("submit", trace_memory=memory_report) as timer:
+        fetch_deadline = Deadline(fetch_budget)
+        output_bytes = 0
+        key_path = DEFAULT_COVER_KEY
+        uploaded_url = ""
+        image_source = None
+
+        # One variant per language; extra languages need their own title and slides
+        variants = [{"lang": language, "title": story_title, "html_file": html_file}]
+        for variant_lang, (variant_title, variant_file) in variant_inputs.items():
+            if variant_lang == language:
+                continue
+            if variant_title.strip() and variant_file:
+                variants.append({"lang": variant_lang, "title": variant_title, "html_file": variant_file})
+            else:
+                st.warning(f"Skipping {variant_lang}: it needs its own title and Raw HTML File.")
+        multi_language = len(variants) > 1
+
+        if existing_story:
+            # Keep the uid and URLs so the update overwrites the same key
+            variants[0].update(
+                nano=existing_story["uid"],
+                slug_nano=existing_story["slug_nano"],
+                canurl=existing_story["fields"]["canurl"],
+                canurl1=existing_story["fields"]["canurl1"],
+            )
+        else:
+            # Every variant's URL is needed up front for the hreflang cross-links
+            for variant in variants:
+                try:
+                    with timer.span("slug"):
+                        nano, slug_nano, canurl, canurl1 = generate_slug_and_urls(variant["title"])
+                except Exception as e:
 
-        filename = os.path.basename(urlparse(image_url).path)
-        ext = os.path.splitext(filename)[1].lower()
-        if ext not in [".jpg", ".jpeg", ".png", ".gif"]:
-            ext = ".jpg"
+                    st.error(f"Error generating canonical URLs: {e}")
+                    nano = slug_nano = canurl = canurl1 = ""
+                variant.update(nano=nano, slug_nano=slug_nano, canurl=canurl, canurl1=canurl1)
+        slug_nano = variants[0]["slug_nano"]
 
-        if image_url.startswith("https://stories.suvichaar.org/"):
+        reuse_cover = bool(existing_story) and image_url == existing_story["image_url"]
 
-            uploaded_url = image_url
-            key_path = "/".join(urlparse(image_url).path.split("/")[2:])
-
-        else:
+        # Image URL handling
+        if reuse_cover:
+            st.info("Cover image unchanged, reusing the published image.")
+        elif image_url:
 
             try:
-                response = requests.get(image_url, timeout=10)
-                response.raise_for_status()
-                unique_filename = f"{uuid.uuid4().hex}{ext}"
-                s3_key = f"{s3_prefix}{unique_filename}"
-                s3_client.put_object(
-                    Bucket=bucket_name,
-                    Key=s3_key,
-                    Body=response.content,
-                    ContentType=response.headers.get("Content-Type", "image/jpeg"),
-                )
-                uploaded_url = f"{cdn_base_url}{s3_key}"
-                key_path = s3_key
-                st.success("Image uploaded successfully!")
+                with timer.span("image_fetch"):
+                    image_source, key_path, uploaded_url = prepare_image(
+                        image_url, s3_client, bucket_name, s3_prefix, cdn_base_url,
+                        deadline=fetch_deadline, hedge_after=fetch_hedge_after,
+                    )
+                if not image_source.on_cdn:
+                    st.success("Image uploaded successfully!")
 
             except Exception as e:
                 st.warning(f"Failed to fetch/upload image. Using fallback. Error: {e}")
+                image_source = None
                 uploaded_url = ""
-    else:
-        st.info("No Image URL provided. Using default.")
-
-    try:
-        template_path = "templates/masterregex.html"
-        with open(template_path, "r", encoding="utf-8") as file:
-            html_template = file.read()
-
-
-        user_mapping = {
-            "Mayank": "https://www.instagram.com/iamkrmayank?igsh=eW82NW1qbjh4OXY2&utm_source=qr",
-            "Onip": "https://www.instagram.com/onip.mathur/profilecard/?igsh=MW5zMm5qMXhybGNmdA==",
-            "Naman": "https://njnaman.in/"
-        }
-
-        filter_tags = [tag.strip() for tag in tag_input.split(",") if tag.strip()]
-
-        category_mapping = {
-            "Art": 21,
-            "Travel": 22,
-            "Entertainment": 23,
-            "Literature": 24,
-            "Books": 25,
-            "Sports": 26,
-            "History": 27,
-            "Culture": 28,
-            "Wildlife": 29,
-            "Spiritual": 30
-        }
-
-        filternumber = category_mapping[categories]
-        selected_user = random.choice(list(user_mapping.keys()))
-        html_template = html_template.replace("{{user}}", selected_user)
-        html_template = html_template.replace("{{userprofileurl}}", user_mapping[selected_user])
-        html_template = html_template.replace("{{publishedtime}}", datetime.now(timezone.utc).isoformat(timespec='seconds'))
-        html_template = html_template.replace("{{modifiedtime}}", datetime.now(timezone.utc).isoformat(timespec='seconds'))
-        html_template = html_template.replace("{{storytitle}}", story_title)
-        html_template = html_template.replace("{{metadescription}}", meta_description)
-        html_template = html_template.replace("{{metakeywords}}", meta_keywords)
-        html_template = html_template.replace("{{contenttype}}", content_type)
-        html_template = html_template.replace("{{lang}}", language)
-        html_template = html_template.replace("{{pagetitle}}", page_title)
-        html_template = html_template.replace("{{canurl}}", canurl)
-        html_template = html_template.replace("{{canurl1}}", canurl1)
-
-        if image_url.startswith("http://media.suvichaar.org") or image_url.startswith("https://media.suvichaar.org"):
-        
-            html_template = html_template.replace("{{image0}}", image_url)
-
-            parsed_cdn_url = urlparse(image_url)
-            cdn_key_path = parsed_cdn_url.path.lstrip("/")  # ✅ Fix
-
-            resize_presets = {
-                "potraitcoverurl": (640, 853),
-                "msthumbnailcoverurl": (300, 300),
+        else:
+            st.info("No Image URL provided. Using default.")
+
+        try:
+            with timer.span("template_load") as span:
+                # Composed and compiled at startup, shared by every language variant
+                layout_name, compiled_template = template_registry.compiled_for(categories, content_type)
+                span["bytes"] = template_registry.sizes[layout_name]
+
+
+            user_mapping = {
+                "Mayank": "https://www.instagram.com/iamkrmayank?igsh=eW82NW1qbjh4OXY2&utm_source=qr",
+                "Onip": "https://www.instagram.com/onip.mathur/profilecard/?igsh=MW5zMm5qMXhybGNmdA==",
+                "Naman": "https://njnaman.in/"
             }
 
-            for label, (width, height) in resize_presets.items():
-                template = {
-                    "bucket": bucket_name,
-                    "key": cdn_key_path,
-                    "edits": {
-                        "resize": {
-                            "width": width,
-                            "height": height,
-                            "fit": "cover"
-                        }
-                    }
-                }
-                encoded = base64.urlsafe_b64encode(json.dumps(template).encode()).decode()
-                final_url = f"{cdn_prefix_media}{encoded}"
-                # st.write(f"✅ Replacing {{{label}}} with {final_url}")
-                html_template = html_template.replace(f"{{{label}}}", final_url)
-
-        # Cleanup step to remove incorrect {url} wrapping
-        html_template = re.sub(r'href="\{(https://[^}]+)\}"', r'href="\1"', html_template)
-        html_template = re.sub(r'src="\{(https://[^}]+)\}"', r'src="\1"', html_template)
-
-        # ----------- Extract <style amp-custom> block from uploaded raw HTML -------------
-        extracted_style = ""
-        if html_file:
-            raw_html = html_file.read().decode("utf-8")
-
-            # Extract <style amp-custom> block
-            style_match = re.search(r"(<style\s+amp-custom[^>]*>.*?</style>)", raw_html, re.DOTALL | re.IGNORECASE)
-            if style_match:
-                extracted_style = style_match.group(1)
+            # Known tags take their most used spelling, so "indian  cinema" joins the "Indian Cinema" feed
+            filter_tags = tag_vocabulary.parse(tag_input)
+            typed_tags = [tag.strip() for tag in tag_input.split(",") if tag.strip()]
+            if filter_tags != typed_tags:
+                st.info("Filter tags normalised to: " + ", ".join(filter_tags))
+
+            category_mapping = {
+                "Art": 21,
+                "Travel": 22,
+                "Entertainment": 23,
+                "Literature": 24,
+                "Books": 25,
+                "Sports": 26,
+                "History": 27,
+                "Culture": 28,
+                "Wildlife": 29,
+                "Spiritual": 30
+            }
+
+            filternumber = category_mapping[categories]
+            now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            if existing_story:
+                # Keep the original author and publish time, only bump modifiedtime
+                selected_user = existing_story["fields"]["user"]
+                published_time = existing_story["fields"]["publishedtime"]
             else:
-                st.info("No <style amp-custom> block found in uploaded HTML.")
-
-            # Extract <amp-story> block
-            start = raw_html.find("<amp-story-page")
-            end = raw_html.rfind("</amp-story-page>")
-            extracted_amp_story = ""
-            if start != -1 and end != -1:
-                extracted_amp_story = raw_html[start:end + len("</amp-story-page>")]
+                selected_user = random.choice(list(user_mapping.keys()))
+                published_time = now
+
+            if existing_story:
+                # Updating one language of a multi-language story keeps its cross-links
+                hreflang = existing_story["fields"].get("hreflang", "")
+                translations = (existing_story.get("metadata") or {}).get("translations")
             else:
-                st.warning("No complete <amp-story> block found in uploaded HTML.")
-        else:
-            extracted_amp_story = ""
-
-        # Insert extracted <style amp-custom> into <head> of your template before </head>
-        if extracted_style:
-            head_close_pos = html_template.lower().find("</head>")
-            if head_close_pos != -1:
-                html_template = (
-                    html_template[:head_close_pos] +
-                    "\n" + extracted_style + "\n" +
-                    html_template[head_close_pos:]
+                hreflang = hreflang_links([(v["lang"], v["canurl"]) for v in variants if v["canurl"]])
+                translations = {v["lang"]: v["canurl"] for v in variants} if multi_language else None
+
+            shared_fields = {
+                "user": selected_user,
+                "userprofileurl": user_mapping.get(selected_user, ""),
+                "publishedtime": published_time,
+                "modifiedtime": now,
+                "metadescription": meta_description,
+                "metakeywords": meta_keywords,
+                "contenttype": content_type,
+                "hreflang": hreflang,
+            }
+
+            if reuse_cover:
+                for name in ("image0", *resize_presets):
+                    if name in existing_story["fields"]:
+                        shared_fields[name] = existing_story["fields"][name]
+
+            elif image_source and uploaded_url:
+
+                shared_fields["image0"] = uploaded_url
+
+                if use_local_variants and image_source.variants:
+                    # Offline mode: resize in our own process pool instead of the media resize service
+                    try:
+                        with timer.span("local_variants") as span:
+                            original = s3_client.get_object(Bucket=bucket_name, Key=key_path)["Body"].read()
+                            variants_by_label = generate_variants_batch([original], resize_presets)[0]
+                            shared_fields.update(upload_variants(s3_client, bucket_name, key_path, variants_by_label, cdn_base_url))
+                            span["bytes"] = sum(len(v[-1]) for v in variants_by_label)
+                    except Exception as e:
+                        st.warning(f"Local variant generation failed, using the resize service. Error: {e}")
+
+                # An encoded edits URL as cover is resized from its original object
+                original = original_object(key_path, bucket_name)
+                if original:
+                    for label, final_url in build_variants(*original, resize_presets, image_source.variants).items():
+                        shared_fields.setdefault(label, final_url)
+
+            if not shared_fields.get("image0"):
+                # No cover, or fetching it failed: the default image and its resizes
+                key_path = DEFAULT_COVER_KEY
+                shared_fields["image0"] = f"{cdn_base_url}{key_path}"
+                for label, final_url in build_variants(bucket_name, key_path, resize_presets).items():
+                    shared_fields.setdefault(label, final_url)
+            # Covers the resize service cannot reach (e.g. stories.suvichaar.org) stand in for their own resizes
+            for label in resize_presets:
+                shared_fields.setdefault(label, shared_fields["image0"])
+
+            variant_markup = []
+            for variant in variants:
+                prefix = f"[{variant['lang']}] " if multi_language else ""
+                fields = {
+                    **shared_fields,
+                    "storytitle": variant["title"],
+                    "lang": variant["lang"],
+                    "pagetitle": f"{variant['title']} | Suvichaar" if variant["slug_nano"] else "",
+                    "canurl": variant["canurl"],
+                    "canurl1": variant["canurl1"],
+                }
+
+                with timer.span("substitution"):
+                    html_template = cleanup_wrapped_urls(render_template(compiled_template, fields))
+
+                # ----------- Extract <style amp-custom> block from uploaded raw HTML -------------
+                # The raw HTML stays bytes: style and slides are memoryviews into it, and only
+                # the <amp-img> tags are decoded for rewriting
+                extracted_style = b""
+                extracted_amp_story = b""
+                slide_segments = []
+                signature = None
+                raw_html = b""
+                with timer.span("html_read") as span:
+                    if variant["html_file"]:
+                        raw_html = read_upload(
+                            variant["html_file"], st.session_state, upload_spill_bytes, upload_spill_dir,
+                            slot=f"spilled_upload_{variant['lang']}",
+                        )
+                    elif existing_story:
+                        # No new upload: keep the slides and styles of the published version
+                        published = s3_client.get_object(Bucket="suvichaarstories", Key=existing_story["s3_key"])
+                        raw_html = published["Body"].read()
+                    span["bytes"] = len(raw_html)
+
+                media_urls = external_media_urls(raw_html) if rehost_slide_media and variant["html_file"] else []
+                if media_urls:
+                    replacements = {}
+                    with timer.span("media_rehost") as span:
+                        span["bytes"] = 0
+                        for media_url in media_urls:
+                            bar = st.progress(0.0, text=f"{prefix}Rehosting {media_url}")
+
+                            def show_progress(done, total, bar=bar, media_url=media_url):
+                                bar.progress(done / total if total else 1.0, text=f"{prefix}Rehosting {media_url}: {done / 1048576:.1f} / {total / 1048576:.1f} MB")
+
+                            try:
+                                result = rehost_media(
+                                    media_url, s3_client, bucket_name, f"{s3_prefix}{uuid.uuid4().hex}{media_extension(media_url)}",
+                                    state_dir=media_rehost_state_dir, progress=show_progress,
+                                )
+                                replacements[media_url] = f"{cdn_base_url}{result['key']}"
+                                span["bytes"] += result["size"]
+                            except Exception as e:
+                                st.warning(f"{prefix}Could not rehost {media_url}, keeping the original URL. A retry resumes the upload. Error: {e}")
+                    raw_html = rewrite_media_urls(raw_html, replacements)
+
+                if raw_html:
+
+                    with timer.span("extraction", len(raw_html)):
+                        extracted_style = extract_style(raw_html)
+                        extracted_amp_story = extract_story_pages(raw_html)
+                    if not extracted_style:
+                        st.info(f"{prefix}No <style amp-custom> block found in uploaded HTML.")
+
+                    if extracted_amp_story:
+                        # Warn before upload when the slides repeat an already published story
+                        with timer.span("near_duplicates"):
+                            signature = signature_for_pages(extracted_amp_story)
+                            duplicates = duplicate_index.query(
+                                signature, duplicate_threshold, exclude={v["slug_nano"] for v in variants}
+                            )
+                        for duplicate_slug, score in duplicates[:5]:
+                            st.warning(
+                                f"{prefix}Slides are {score:.0%} similar to an already published story: "
+                                f"https://suvichaar.org/stories/{duplicate_slug}"
+                            )
+                        slide_segments = split_img_tags(extracted_amp_story)
+                        with timer.span("srcset"):
+                            slide_segments[1::2] = add_srcsets(slide_segments[1::2], bucket_name, srcset_widths)
+                        # Intrinsic sizes from the first few KB of each image, to avoid layout shift
+                        with timer.span("image_probe"):
+                            slide_segments[1::2] = fill_tag_dimensions(
+                                slide_segments[1::2], deadline=fetch_deadline, hedge_after=fetch_hedge_after
+                            )
+                    else:
+                        st.warning(f"{prefix}No complete <amp-story> block found in uploaded HTML.")
+
+                with timer.span("insertion"):
+                    story_parts, insertion_warnings = assemble_story_parts(html_template, extracted_style, slide_segments)
+                for warning in insertion_warnings:
+                    st.warning(prefix + warning)
+
+                #st.markdown("### Final Modified HTML")
+                # st.code(html_template, language="html")
+
+                # ----------- Generate and Provide Metadata JSON -------------
+                metadata_dict = {
+                    "story_title": variant["title"],
+                    "categories": filternumber,
+                    "filterTags": filter_tags,
+                    "story_uid": variant["nano"],
+                    "story_link": variant["canurl"],
+                    "storyhtmlurl": variant["canurl1"],
+                    "urlslug": variant["slug_nano"],
+                    "cover_image_link": cover_image_url,
+                    "publisher_id": 3,
+                    "story_logo_link": "https://media.suvichaar.org/filters:resize/96x96/media/brandasset/suvichaariconblack.png",
+                    "keywords": meta_keywords,
+                    "metadescription": meta_description,
+                    "lang": variant["lang"]
+                }
+                if translations:
+                    metadata_dict["translations"] = translations
+
+                # Encoded once; the same bytes are the S3 body and the ZIP entry
+                with timer.span("encode") as span:
+                    html_body = encode_parts(story_parts)
+                    span["bytes"] = len(html_body)
+                output_bytes += len(html_body)
+                with timer.span("lint"):
+                    lint_report = lint_story(html_body)
+                if lint_report["issues"]:
+                    with st.expander(f"{prefix}AMP lint: {lint_report['errors']} error(s)", expanded=bool(lint_report["errors"])):
+                        st.dataframe(lint_report["issues"])
+                # srcset URLs live in the template and the rewritten tags; no need to scan the full body
+                variant_markup.append(html_template)
+                variant_markup.extend(slide_segments[1::2])
+                del story_parts, slide_segments, extracted_style, extracted_amp_story
+
+                variant.update(
+                    fields=fields, metadata=metadata_dict, body=html_body, lint=lint_report, signature=signature,
+                    s3_key=f"{variant['slug_nano']}.html",
                 )
-            else:
-                st.warning("No </head> tag found in HTML template to insert <style amp-custom>.")
-
-        # Insert extracted AMP story block inside template
-        if extracted_amp_story:
-            # Locate opening <amp-story> tag in template
-            amp_story_opening_match = re.search(r"<amp-story\b[^>]*>", html_template)
-            analytics_tag = '<amp-story-auto-analytics gtag-id="G-2D5GXVRK1E" class="i-amphtml-layout-container" i-amphtml-layout="container"></amp-story-auto-analytics>'
-
-            if amp_story_opening_match and analytics_tag in html_template:
-                insert_pos = amp_story_opening_match.end()
-                # Insert the extracted story slides just after the opening tag, before analytics tag
-                html_template = (
-                    html_template[:insert_pos]
-                    + "\n\n"
-                    + extracted_amp_story
-                    + "\n\n"
-                    + html_template[insert_pos:]
+
+            lint_errors = sum(variant["lint"]["errors"] for variant in variants)
+            if lint_errors and lint_blocking:
+                raise LintFailed(f"AMP lint found {lint_errors} error(s); nothing was uploaded.")
+
+            # All variants go up together
+            with timer.span("s3_put", output_bytes):
+                put_jobs = [
+                    s3_executor.submit(
+                        s3_client.put_object,
+                        Bucket="suvichaarstories",
+                        Key=variant["s3_key"],
+                        Body=variant["body"],
+                        ContentType="text/html",
+                    )
+                    for variant in variants
+                ]
+                for job in put_jobs:
+                    job.result()
+
+            st.success("✅ HTML uploaded successfully to S3!")
+
+            # Warm the resize cache in the background; the results panel below the
+            # form picks the job up from the session and polls it
+            if prewarm_cdn:
+                st.session_state.prewarm_job = {
+                    "slug": slug_nano,
+                    "started": time.monotonic(),
+                    "future": start_prewarm(
+                        collect_variant_urls("\n".join(variant_markup), [shared_fields[label] for label in resize_presets if label in shared_fields], MEDIA_CDN),
+                        max_workers=prewarm_concurrency,
+                        budget=prewarm_budget,
+                    ),
+                }
+            for variant in variants:
+                final_story_url = f"https://suvichaar.org/stories/{variant['slug_nano']}"  # This is your canurl
+                language_note = f" ({variant['lang']})" if multi_language else ""
+                st.markdown(f"🔗 **Live Story URL{language_note}:** [Click to view your story]({final_story_url})")
+
+            if existing_story:
+                updated = changed_fields(existing_story["fields"], variants[0]["fields"])
+                st.info("Updated fields: " + ", ".join(updated))
+            for variant in variants:
+                if variant["slug_nano"]:
+                    with timer.span("index_record"):
+                        story_index.record({
+                            "slug_nano": variant["slug_nano"],
+                            "uid": variant["nano"],
+                            "publishedtime": variant["fields"]["publishedtime"],
+                            "modifiedtime": variant["fields"]["modifiedtime"],
+                            "s3_key": variant["s3_key"],
+                            "image_url": image_url,
+                            "fields": variant["fields"],
+                            "metadata": variant["metadata"],
+                        })
+                        duplicate_index.add(variant["slug_nano"], variant["signature"])
+
+            with timer.span("zip_build") as span:
+                zip_buffer = build_bundle_zip(
+                    [(v["slug_nano"], v["body"], json.dumps(v["metadata"], indent=4)) for v in variants]
                 )
-            else:
-                st.warning("Could not find insertion points in the HTML template.")
-
-        #st.markdown("### Final Modified HTML")
-        # st.code(html_template, language="html")
-
-        # ----------- Generate and Provide Metadata JSON -------------
-        metadata_dict = {
-            "story_title": story_title,
-            "categories": filternumber,
-            "filterTags": filter_tags,
-            "story_uid": nano,
-            "story_link": canurl,
-            "storyhtmlurl": canurl1,
-            "urlslug": slug_nano,
-            "cover_image_link": cover_image_url,
-            "publisher_id": 3,
-            "story_logo_link": "https://media.suvichaar.org/filters:resize/96x96/media/brandasset/suvichaariconblack.png",
-            "keywords": meta_keywords,
-            "metadescription": meta_description,
-            "lang": language
-        }
-
-        s3_key = f"{slug_nano}.html"
-
-        s3_client.put_object(
-            Bucket="suvichaarstories",
-            Key=s3_key,
-            Body=html_template.encode("utf-8"),
-            ContentType="text/html",
-        )
+                span["bytes"] = zip_buffer.getbuffer().nbytes
 
-        final_story_url = f"https://suvichaar.org/stories/{slug_nano}"  # This is your canurl
-        st.success("✅ HTML uploaded successfully to S3!")
-        st.markdown(f"🔗 **Live Story URL:** [Click to view your story]({final_story_url})")
-        
-        json_str = json.dumps(metadata_dict, indent=4)
-
-        # Save data to session_state
-        zip_buffer = BytesIO()
-
-        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-            zip_file.writestr(f"{slug_nano}.html", html_template)
-            zip_file.writestr(f"{slug_nano}_metadata.json", json_str)
-        
-        zip_buffer.seek(0)
-
-        st.download_button(
-            label="📦 Download HTML + Metadata ZIP",
-            data=zip_buffer,
-            file_name=f"{story_title}.zip",
-            mime="application/zip"
-        )
+            st.download_button(
+                label="📦 Download HTML + Metadata ZIP",
+                data=zip_buffer,
+                file_name=f"{story_title}.zip",
+                mime="application/zip"
+            )
+
+        except Exception as e:
+            st.error(f"Error processing HTML: {e}")
+
+        # Per-stage timings for this submit: UI panel, JSON log line and /metrics
+        submit_timing = timer.finish(slug=slug_nano, output_bytes=output_bytes)
+
+    with st.expander(f"⏱ Submit timings ({submit_timing['total_seconds']:.2f}s)"):
+        if "peak_bytes" in submit_timing and output_bytes:
+            st.write(
+                f"Peak memory {submit_timing['peak_bytes'] / 1048576:.2f} MB for "
+                f"{output_bytes / 1048576:.2f} MB of HTML "
+                f"({submit_timing['peak_bytes'] / output_bytes:.1f}x the output)"
+            )
+        st.dataframe(submit_timing["spans"])
+
+# CDN warm-up of the last submit. The job runs in a background pool; this panel
+# polls it in a fragment, so neither the submit nor later reruns wait for it.
+PREWARM_POLL_SECONDS = 2
+prewarm_job = st.session_state.get("prewarm_job")
+if prewarm_job:
+    # run_every is fixed when the fragment is defined, so once the job is done
+    # a polling fragment reruns the app to be defined again without it
+    polling = not prewarm_job["future"].done()
+
+    @st.fragment(run_every=PREWARM_POLL_SECONDS if polling else None)
+    def show_prewarm(job):
+        future = job["future"]
+        if polling and future.done():
+            st.rerun(scope="app")
+        with st.expander(f"CDN warm-up for {job['slug']}", expanded=False):
+            if not future.done():
+                waited = time.monotonic() - job["started"]
+                if waited > prewarm_budget + 5:
+                    st.warning(f"Still running after {waited:.0f}s; other warm-ups may be queued ahead of it.")
+                else:
+                    st.caption(f"Warming variant URLs… ({waited:.0f}s)")
+                return
+            if future.exception() is not None:
+                st.warning(f"CDN warm-up failed: {type(future.exception()).__name__}: {future.exception()}")
+                return
+            warmup = future.result()
+            timed = [r["seconds"] for r in warmup if isinstance(r["status"], int) and r["status"] < 400]
+            st.write(
+                f"Warmed {len(timed)}/{len(warmup)} variant URLs"
+                + (f", slowest {max(timed):.2f}s" if timed else "")
+            )
+            st.dataframe(warmup)
 
-    except Exception as e:
-        st.error(f"Error processing HTML: {e}")
+    show_prewarm(prewarm_job)
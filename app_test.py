@@ -14,6 +14,8 @@ from datetime import datetime, timezone
 import re
 from io import BytesIO
 import zipfile
+from story_render import render_template
+from template_registry import TemplateRegistry
 # Load environment variables
 load_dotenv()
 
@@ -40,6 +42,13 @@ s3_client = boto3.client(
     region_name=region_name,
 )
 
+# Page layouts, composed from shared partials once per process
+@st.cache_resource
+def load_template_registry(directory):
+    return TemplateRegistry(directory)
+
+template_registry = load_template_registry(st.secrets.get("TEMPLATES_DIR", "templates"))
+
 # Slug and URL generator
 def generate_slug_and_urls(title):
     if not title or not isinstance(title, str):
@@ -238,9 +247,7 @@ if submit_button:
         st.info("No Image URL provided. Using default.")
 
     try:
-        template_path = "templates/masterregex.html"
-        with open(template_path, "r", encoding="utf-8") as file:
-            html_template = file.read()
+        _, compiled_template = template_registry.compiled_for(categories, content_type)
 
 
         user_mapping = {
@@ -266,22 +273,26 @@ if submit_button:
 
         filternumber = category_mapping[categories]
         selected_user = random.choice(list(user_mapping.keys()))
-        html_template = html_template.replace("{{user}}", selected_user)
-        html_template = html_template.replace("{{userprofileurl}}", user_mapping[selected_user])
-        html_template = html_template.replace("{{publishedtime}}", datetime.now(timezone.utc).isoformat(timespec='seconds'))
-        html_template = html_template.replace("{{modifiedtime}}", datetime.now(timezone.utc).isoformat(timespec='seconds'))
-        html_template = html_template.replace("{{storytitle}}", story_title)
-        html_template = html_template.replace("{{metadescription}}", meta_description)
-        html_template = html_template.replace("{{metakeywords}}", meta_keywords)
-        html_template = html_template.replace("{{contenttype}}", content_type)
-        html_template = html_template.replace("{{lang}}", language)
-        html_template = html_template.replace("{{pagetitle}}", page_title)
-        html_template = html_template.replace("{{canurl}}", canurl)
-        html_template = html_template.replace("{{canurl1}}", canurl1)
+        fields = {
+            "user": selected_user,
+            "userprofileurl": user_mapping[selected_user],
+            "publishedtime": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "modifiedtime": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "storytitle": story_title,
+            "metadescription": meta_description,
+            "metakeywords": meta_keywords,
+            "contenttype": content_type,
+            "lang": language,
+            "pagetitle": page_title,
+            "canurl": canurl,
+            "canurl1": canurl1,
+            # Single-language page: no alternate links
+            "hreflang": "",
+        }
 
         if image_url.startswith("http://media.suvichaar.org") or image_url.startswith("https://media.suvichaar.org"):
         
-            html_template = html_template.replace("{{image0}}", image_url)
+            fields["image0"] = image_url
 
             parsed_cdn_url = urlparse(image_url)
             cdn_key_path = parsed_cdn_url.path.lstrip("/")  # ✅ Fix
@@ -305,8 +316,9 @@ if submit_button:
                 }
                 encoded = base64.urlsafe_b64encode(json.dumps(template).encode()).decode()
                 final_url = f"{cdn_prefix_media}{encoded}"
-                # st.write(f"✅ Replacing {{{label}}} with {final_url}")
-                html_template = html_template.replace(f"{{{label}}}", final_url)
+                fields[label] = final_url
+
+        html_template = render_template(compiled_template, fields)
 
         # Cleanup step to remove incorrect {url} wrapping
         html_template = re.sub(r'href="\{(https://[^}]+)\}"', r'href="\1"', html_template)
@@ -0,0 +1,36 @@
+import json
+import os
+
+# Append-only files (JSON lines, binary records). A crash mid-write can leave a
+# torn last entry: readers stop before it, and the owner cuts it off at load so
+# its next append starts on a clean boundary.
+
+
+def truncate_torn_tail(path, good_end):
+    if os.path.exists(path) and os.path.getsize(path) > good_end:
+        with open(path, "r+b") as file:
+            file.truncate(good_end)
+
+
+# (byte offset, record) for every complete JSON line; lines that do not parse
+# are skipped. With repair, a torn last line is cut off after reading.
+def read_json_lines(path, repair=False):
+    if not os.path.exists(path):
+        return
+    good_end = 0
+    with open(path, "rb") as file:
+        offset = 0
+        for line in file:
+            start, offset = offset, offset + len(line)
+            if not line.endswith(b"\n"):
+                break
+            good_end = offset
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield start, record
+    if repair:
+        truncate_torn_tail(path, good_end)
@@ -0,0 +1,126 @@
+# CDN warm-up (cdn_prewarm.prewarm) against a local HTTP stand-in for the resize
+# CDN: the first request for a URL is slow and answered "X-Cache: Miss", later
+# ones are fast hits. Reports the cold warm-up times, the reader's latency after
+# warm-up, and checks that the concurrency bound and the time budget hold
+# (exit 1 if not).
+#
+#   python benchmarks/bench_prewarm.py --urls 24 --cold 0.3 --workers 8
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cdn_prewarm import collect_variant_urls, prewarm  # noqa: E402
+from http_client import fetch  # noqa: E402
+
+BODY = b"\xff\xd8" + bytes(32 * 1024)
+
+
+# Resize CDN stand-in; `slow_paths` never finish within any sensible budget
+def start_cdn(cold, slow_paths=(), slow_seconds=30):
+    state = {"warm": set(), "active": 0, "max_active": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            with lock:
+                hit = self.path in state["warm"]
+                state["active"] += 1
+                state["max_active"] = max(state["max_active"], state["active"])
+            try:
+                if self.path in slow_paths:
+                    time.sleep(slow_seconds)
+                elif not hit:
+                    time.sleep(cold)
+                with lock:
+                    state["warm"].add(self.path)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(BODY)))
+                self.send_header("X-Cache", "Hit" if hit else "Miss")
+                self.end_headers()
+                self.wfile.write(BODY)
+            finally:
+                with lock:
+                    state["active"] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            if not isinstance(sys.exc_info()[1], ConnectionError):
+                super().handle_error(request, client_address)
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="bench-cdn").start()
+    return server, f"http://127.0.0.1:{server.server_port}", state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", type=int, default=24, help="Variant URLs to warm")
+    parser.add_argument("--cold", type=float, default=0.3, help="Seconds for a cache miss at the stand-in")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--budget", type=float, default=5.0)
+    args = parser.parse_args()
+
+    failures = []
+    server, base, state = start_cdn(args.cold, slow_paths=("/slow.jpg",))
+    try:
+        # Warm-up of a story's srcset URLs, as collected from the rendered slides
+        markup = " ".join(
+            f'<amp-img src="{base}/{n}.jpg" srcset="{base}/{n}.jpg?w=320 320w, {base}/{n}.jpg?w=640 640w"></amp-img>'
+            for n in range(args.urls // 2)
+        )
+        urls = collect_variant_urls(markup, cdn_prefix=base)
+        started = time.perf_counter()
+        results = prewarm(urls, max_workers=args.workers, budget=args.budget)
+        elapsed = time.perf_counter() - started
+        seconds = sorted(r["seconds"] for r in results if r["status"] == 200)
+        print(
+            f"Warmed {len(seconds)}/{len(urls)} URLs in {elapsed:.2f}s with {args.workers} workers; "
+            f"miss p50 {seconds[len(seconds) // 2]:.3f}s, slowest {seconds[-1]:.3f}s"
+        )
+        if len(seconds) != len(urls) or any(r["cache"] != "Miss" for r in results):
+            failures.append("not every URL was fetched once as a cache miss")
+        if state["max_active"] > args.workers:
+            failures.append(f"{state['max_active']} concurrent requests with {args.workers} workers")
+
+        # What the first reader sees afterwards
+        reader = []
+        for url in urls[:8]:
+            t0 = time.perf_counter()
+            response = fetch(url)
+            reader.append(time.perf_counter() - t0)
+            if response.headers.get("X-Cache") != "Hit":
+                failures.append(f"{url} still cold after warm-up")
+        print(f"Reader after warm-up: mean {sum(reader) / len(reader) * 1000:.1f} ms (cold miss {args.cold * 1000:.0f} ms)")
+
+        # A URL that hangs is reported as skipped when the budget runs out
+        budget = min(args.budget, 1.0)
+        started = time.perf_counter()
+        results = prewarm([f"{base}/slow.jpg", f"{base}/fresh.jpg"], max_workers=2, budget=budget)
+        elapsed = time.perf_counter() - started
+        statuses = {r["url"].rsplit("/", 1)[1]: r["status"] for r in results}
+        print(f"Budget {budget:.1f}s with a hanging URL: returned after {elapsed:.2f}s, {statuses}")
+        if statuses != {"slow.jpg": "skipped", "fresh.jpg": 200} or elapsed > budget + 0.5:
+            failures.append("time budget not respected")
+    finally:
+        server.shutdown()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# Render-pipeline benchmark on synthetic stories (5 to 500 pages, small to
+# multi-MB CSS), run against a local S3 stand-in and a mocked LLM.
+# Reports latency percentiles, throughput and peak memory per scenario and
+# fails (exit 1) when a scenario regresses past the stored baseline.
+#
+#   python benchmarks/bench_render.py                    # compare with baseline.json
+#   python benchmarks/bench_render.py --update-baseline  # record a new baseline
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from llm_usage import AccountedLLM, UsageStore  # noqa: E402
+from local_s3 import LocalS3Client  # noqa: E402
+from mock_llm import MockLLM  # noqa: E402
+from pipeline_timing import PipelineTimer, StageMetrics  # noqa: E402
+from amp_lint import lint_story  # noqa: E402
+from image_variants import add_srcsets  # noqa: E402
+from story_render import (  # noqa: E402
+    assemble_story_parts,
+    build_story_zip,
+    cleanup_wrapped_urls,
+    encode_parts,
+    extract_story_pages,
+    extract_style,
+    render_template,
+    split_img_tags,
+)
+from template_registry import TemplateRegistry  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+TEMPLATES_DIR = os.path.join(ROOT, "templates")
+
+# Keep the per-run pipeline_timing log lines out of the report
+logging.getLogger("suvichaar.pipeline").setLevel(logging.WARNING)
+
+# name, pages, CSS bytes
+SCENARIOS = [
+    ("5p-4KB", 5, 4 * 1024),
+    ("50p-64KB", 50, 64 * 1024),
+    ("200p-512KB", 200, 512 * 1024),
+    ("500p-4MB", 500, 4 * 1024 * 1024),
+]
+
+WORDS = "lata mangeshkar voice india music cinema golden era playback song legend culture heritage".split()
+
+
+def synthetic_css(size, rng):
+    rules = []
+    total = 0
+    i = 0
+    while total < size:
+        rule = f".s{i} .c{rng.randrange(1000)}{{color:#{rng.randrange(16 ** 6):06x};margin:{rng.randrange(40)}px}}"
+        rules.append(rule)
+        total += len(rule)
+        i += 1
+    return "".join(rules)[:size]
+
+
+def synthetic_story(pages, css_bytes, seed=0):
+    rng = random.Random(seed)
+    slides = []
+    for n in range(pages):
+        text = " ".join(rng.choice(WORDS) for _ in range(40))
+        slides.append(
+            f'<amp-story-page id="page-{n}" auto-advance-after="7s">'
+            f'<amp-story-grid-layer template="fill"><amp-img src="https://media.suvichaar.org/media/bench/{n}.jpg" '
+            f'width="720" height="1280" layout="fill"></amp-img></amp-story-grid-layer>'
+            f'<amp-story-grid-layer template="vertical"><h1>Slide {n}</h1><p>{text}</p></amp-story-grid-layer>'
+            f"</amp-story-page>"
+        )
+    return (
+        "<!doctype html><html amp><head><meta charset=\"utf-8\">"
+        f"<style amp-custom>{synthetic_css(css_bytes, rng)}</style></head>"
+        f"<body><amp-story standalone>{''.join(slides)}</amp-story></body></html>"
+    ).encode("utf-8")
+
+
+# The app.py submit path, stage for stage, minus Streamlit and network
+def run_pipeline(raw_bytes, compiled_template, s3, llm, timer):
+    with timer.span("llm"):
+        llm.chat.completions.create(
+            model="gpt-4", messages=[{"role": "user", "content": "Generate the following for a web story titled 'Bench story'"}],
+            max_tokens=300, purpose="metadata", story="Bench story",
+        )
+    fields = {
+        "user": "Bench", "userprofileurl": "https://example.org/", "publishedtime": "2026-01-01T00:00:00+00:00",
+        "modifiedtime": "2026-01-01T00:00:00+00:00", "storytitle": "Bench story", "metadescription": "Bench",
+        "metakeywords": "bench", "contenttype": "Article", "lang": "en-US", "pagetitle": "Bench story | Suvichaar",
+        "canurl": "https://suvichaar.org/stories/bench", "canurl1": "https://stories.suvichaar.org/bench.html",
+        "image0": "https://media.suvichaar.org/media/bench/cover.jpg", "hreflang": "",
+    }
+    with timer.span("substitution"):
+        html = cleanup_wrapped_urls(render_template(compiled_template, fields))
+    with timer.span("extraction", len(raw_bytes)):
+        style = extract_style(raw_bytes)
+        segments = split_img_tags(extract_story_pages(raw_bytes))
+    with timer.span("srcset"):
+        segments[1::2] = add_srcsets(segments[1::2], "suvichaarstories", (320, 640))
+    with timer.span("insertion"):
+        parts, _ = assemble_story_parts(html, style, segments)
+    with timer.span("encode") as span:
+        body = encode_parts(parts)
+        span["bytes"] = len(body)
+    # Pages are cached by hash, so after the warm-up this is the incremental re-check
+    with timer.span("lint"):
+        lint_story(body)
+    with timer.span("s3_put", len(body)):
+        s3.put_object(Bucket="suvichaarstories", Key="bench.html", Body=body, ContentType="text/html")
+    with timer.span("zip_build"):
+        build_story_zip("bench", body, json.dumps(fields, indent=4))
+    return len(body)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def bench_scenario(name, pages, css_bytes, runs, compiled_template):
+    raw = synthetic_story(pages, css_bytes)
+    s3 = LocalS3Client()
+    # Accounted like the app's client, uncached so every run pays for the call
+    llm = AccountedLLM(MockLLM(), UsageStore(":memory:"))
+    metrics = StageMetrics()
+
+    run_pipeline(raw, compiled_template, s3, llm, PipelineTimer("bench", metrics))  # warm-up
+    latencies = []
+    stage_totals = {}
+    started = time.perf_counter()
+    for _ in range(runs):
+        timer = PipelineTimer("bench", metrics)
+        t0 = time.perf_counter()
+        output_bytes = run_pipeline(raw, compiled_template, s3, llm, timer)
+        latencies.append(time.perf_counter() - t0)
+        for span in timer.spans:
+            stage_totals[span["stage"]] = stage_totals.get(span["stage"], 0.0) + span["seconds"]
+    elapsed = time.perf_counter() - started
+
+    # Peak memory is measured on its own run; tracemalloc would skew the timings.
+    # The input is allocated before tracing starts, so the peak is what the pipeline adds.
+    traced = PipelineTimer("bench", metrics, trace_memory=True)
+    run_pipeline(raw, compiled_template, s3, llm, traced)
+    peak = traced.finish()["peak_bytes"]
+
+    return {
+        "scenario": name,
+        "pages": pages,
+        "input_bytes": len(raw),
+        "output_bytes": output_bytes,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "stories_per_s": round(runs / elapsed, 2),
+        "peak_mb": round(peak / 1024 / 1024, 3),
+        "peak_x_output": round(peak / output_bytes, 2),
+        "stage_ms": {stage: round(total / runs * 1000, 3) for stage, total in stage_totals.items()},
+    }
+
+
+def compare(results, baseline, latency_tolerance, memory_tolerance):
+    failures = []
+    for result in results:
+        base = baseline.get("scenarios", {}).get(result["scenario"])
+        if not base:
+            continue
+        if result["p50_ms"] > base["p50_ms"] * (1 + latency_tolerance):
+            failures.append(f"{result['scenario']}: p50 {result['p50_ms']}ms vs baseline {base['p50_ms']}ms")
+        if result["peak_mb"] > base["peak_mb"] * (1 + memory_tolerance):
+            failures.append(f"{result['scenario']}: peak {result['peak_mb']}MB vs baseline {base['peak_mb']}MB")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--scenario", action="append", help="Only run the named scenario(s)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--latency-tolerance", type=float, default=0.5, help="Allowed p50 slowdown, 0.5 = +50%%")
+    parser.add_argument("--memory-tolerance", type=float, default=0.1, help="Allowed peak memory growth")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    # Compiled once, as the app does at startup
+    _, compiled_template = TemplateRegistry(TEMPLATES_DIR).compiled_for()
+
+    results = []
+    print(f"{'scenario':<12} {'pages':>5} {'input':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'stories/s':>10} {'peak MB':>9} {'xoutput':>8}")
+    for name, pages, css_bytes in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        result = bench_scenario(name, pages, css_bytes, args.runs, compiled_template)
+        results.append(result)
+        print(
+            f"{name:<12} {pages:>5} {result['input_bytes']:>10} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+            f"{result['p99_ms']:>9} {result['stories_per_s']:>10} {result['peak_mb']:>9} {result['peak_x_output']:>8}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.update_baseline:
+        baseline = {
+            "machine": f"{platform.machine()} / {platform.python_implementation()} {platform.python_version()}",
+            "runs": args.runs,
+            "scenarios": {r["scenario"]: {"p50_ms": r["p50_ms"], "peak_mb": r["peak_mb"]} for r in results},
+        }
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(baseline, file, indent=2)
+            file.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline file; run with --update-baseline to record one.")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        failures = compare(results, json.load(file), args.latency_tolerance, args.memory_tolerance)
+    if failures:
+        print("\nREGRESSION against baseline:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+# Load test of app.py under concurrent editor sessions. Each simulated session
+# opens the app, types a title (metadata generation) and submits a story with a
+# cover image and slide images, through Streamlit's AppTest, all in this one
+# process like sessions on one server worker. S3 and the LLM are the local
+# stand-ins (S3_BACKEND=local, LLM_BACKEND=mock) and images come from a local
+# origin with a configurable delay. Reports page-load rerun, metadata rerun and
+# submit latency percentiles and worker memory at each concurrency level.
+# Running many AppTests at once takes patching AppTest's private internals (see
+# share_runtime); this was written against Streamlit 1.66 and stops with an
+# error naming what is missing on a release that moved them.
+#
+#   python benchmarks/bench_sessions.py                       # 1, 2, 4 and 8 sessions
+#   python benchmarks/bench_sessions.py --sessions 1,4,16 --llm-latency 1.5
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import streamlit as st  # noqa: E402
+from PIL import Image  # noqa: E402
+from streamlit import config  # noqa: E402
+import streamlit.testing.v1.app_test as app_test_module  # noqa: E402
+import streamlit.testing.v1.local_script_runner as local_script_runner_module  # noqa: E402
+from streamlit.components.v2.component_manager import BidiComponentManager  # noqa: E402
+from streamlit.runtime import Runtime  # noqa: E402
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager  # noqa: E402
+from streamlit.runtime.dataframe_source_manager import DataframeSourceManager  # noqa: E402
+from streamlit.runtime.media_file_manager import MediaFileManager  # noqa: E402
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage  # noqa: E402
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache  # noqa: E402
+from streamlit.runtime.secrets import Secrets  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from pipeline_timing import logger as pipeline_logger  # noqa: E402
+
+APP_PATH = os.path.join(ROOT, "app.py")
+TESTED_STREAMLIT = "1.66"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Keep the per-submit pipeline_timing log lines out of the report
+pipeline_logger.setLevel(logging.WARNING)
+# Session threads are not script threads; Streamlit warns about each of them
+# (a filter, since Streamlit resets its loggers' levels)
+logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+    lambda record: "missing ScriptRunContext" not in record.getMessage()
+)
+
+
+# AppTest is built for one app at a time: each run installs its own runtime and
+# compiles the script again, and clears the runtime when it ends, under any run
+# still going in another thread. It also turns the global.appTest option on for
+# the length of a run by patching config.get_option, so a run that ends switches
+# it off for the others (their selectboxes then lose the format_func AppTest
+# reads back, a KeyError on '$$ID-...'). Give all sessions one runtime and one
+# script cache, as on a server, with secrets and global.appTest set once for the
+# process (AppTest swaps st.secrets per run otherwise).
+def share_runtime(secrets):
+    missing = [
+        name for module, name in (
+            (app_test_module, "Runtime"), (app_test_module, "ScriptCache"),
+            (local_script_runner_module, "ScriptCache"), (app_test_module, "patch_config_options"),
+        )
+        if not hasattr(module, name)
+    ]
+    if missing or not hasattr(Runtime, "_instance"):
+        raise RuntimeError(
+            f"Streamlit {st.__version__} moved the AppTest internals this benchmark patches "
+            f"({', '.join(missing) or 'Runtime._instance'}); it was written against Streamlit {TESTED_STREAMLIT}"
+        )
+
+    class PinnedRuntime(Runtime):
+        pass
+
+    runtime = app_test_module.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    runtime.bidi_component_registry = BidiComponentManager()
+    Runtime._instance = runtime
+    # AppTest now sets and clears the subclass attribute; Runtime.instance() keeps ours
+    app_test_module.Runtime = PinnedRuntime
+    script_cache = ScriptCache()
+    app_test_module.ScriptCache = local_script_runner_module.ScriptCache = lambda: script_cache
+    config.set_option("global.appTest", True)
+
+    shared_secrets = Secrets()
+    shared_secrets._secrets = secrets
+    st.secrets = shared_secrets
+
+
+def synthetic_jpeg(width, height):
+    out = BytesIO()
+    Image.new("RGB", (width, height), (180, 90, 40)).save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+# Image origin for cover fetches and slide-image probes; every response waits `delay`
+def start_origin(delay):
+    body = synthetic_jpeg(720, 1280)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if delay:
+                time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        # Probes read the headers and hang up; that is not an error
+        def handle_error(self, request, client_address):
+            if not isinstance(sys.exc_info()[1], ConnectionError):
+                super().handle_error(request, client_address)
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="bench-origin").start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def synthetic_story(origin, session, pages):
+    slides = "".join(
+        f'<amp-story-page id="page-{n}"><amp-story-grid-layer template="vertical">'
+        f'<amp-img src="{origin}/s{session}/slide-{n}.jpg" layout="responsive"></amp-img>'
+        f"<h1>Slide {n}</h1><p>Session {session} slide {n} text about music, cinema and culture.</p>"
+        f"</amp-story-grid-layer></amp-story-page>"
+        for n in range(pages)
+    )
+    return (
+        '<!doctype html><html amp><head><meta charset="utf-8"><style amp-custom>h1{color:#333}</style></head>'
+        f"<body><amp-story standalone>{slides}</amp-story></body></html>"
+    ).encode("utf-8")
+
+
+def app_secrets(data_dir, llm_latency):
+    return {
+        "S3_BACKEND": "local",
+        "S3_LOCAL_ROOT": os.path.join(data_dir, "s3"),
+        "AWS_BUCKET": "suvichaarstories",
+        "S3_PREFIX": "media/",
+        "CDN_BASE": "https://media.suvichaar.org/",
+        "LLM_BACKEND": "mock",
+        "MOCK_LLM_LATENCY": llm_latency,
+        # Every title is new, but keep the cache out of the picture anyway
+        "LLM_CACHE_TTL": 0,
+        "LLM_USAGE_DB": os.path.join(data_dir, "llm_usage.sqlite3"),
+        "STORY_INDEX_PATH": os.path.join(data_dir, "story_index.jsonl"),
+        "STORY_SEARCH_SNAPSHOT": os.path.join(data_dir, "story_search.pickle"),
+        "NEAR_DUPLICATES_PATH": os.path.join(data_dir, "near_duplicates.bin"),
+        "METADATA_FEED_DIR": os.path.join(data_dir, "feed"),
+        "MEDIA_REHOST_STATE_DIR": os.path.join(data_dir, "rehost"),
+        # The app's default is relative to the working directory
+        "TEMPLATES_DIR": os.path.join(ROOT, "templates"),
+    }
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # Peak, not current, where /proc is missing (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Highest RSS seen while a level runs
+class MemorySampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="bench-rss")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def _problems(at):
+    return [str(e.value) for e in at.exception] + [str(e.value) for e in at.error]
+
+
+def _widget(at, kind, label):
+    elements = getattr(at, kind)
+    for element in elements:
+        if element.label == label:
+            return element
+    problems = _problems(at)
+    raise LookupError(
+        f"No {kind} labelled {label!r}; the page has {[element.label for element in elements]}"
+        + (f" and shows: {' | '.join(problems)}" if problems else "")
+    )
+
+
+# One editor: open the app, type a title, fill the form and submit
+def run_session(session, origin, pages, timeout, run_id):
+    timings = {}
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    started = time.perf_counter()
+    at.run()
+    timings["load"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    _widget(at, "text_input", "Story Title").input(f"Load test story {run_id}-{session}").run()
+    timings["metadata"] = time.perf_counter() - started
+
+    _widget(at, "text_input", "Enter your Image URL").input(f"{origin}/s{session}/cover-{run_id}.jpg")
+    at.file_uploader[0].set_value((f"story-{session}.html", synthetic_story(origin, f"{run_id}-{session}", pages), "text/html"))
+    started = time.perf_counter()
+    _widget(at, "button", "Submit").click().run()
+    timings["submit"] = time.perf_counter() - started
+
+    problems = _problems(at)
+    if not any("uploaded successfully" in str(s.value) for s in at.success):
+        problems.append("no upload confirmation")
+    return timings, problems
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_level(concurrency, rounds, origin, pages, timeout, run_id):
+    samples = {"load": [], "metadata": [], "submit": []}
+    failures = []
+    lock = threading.Lock()
+
+    def worker(session):
+        for round_number in range(rounds):
+            try:
+                timings, problems = run_session(session, origin, pages, timeout, f"{run_id}-{round_number}")
+            except Exception as e:
+                timings, problems = {}, [f"{type(e).__name__}: {e}"]
+            with lock:
+                for stage, seconds in timings.items():
+                    samples[stage].append(seconds)
+                failures.extend(f"session {session}: {problem}" for problem in problems)
+
+    threads = [threading.Thread(target=worker, args=(n,), name=f"bench-session-{n}") for n in range(concurrency)]
+    started = time.perf_counter()
+    with MemorySampler() as memory:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = {"sessions": concurrency, "submits": len(samples["submit"]), "failures": len(failures)}
+    for stage, values in samples.items():
+        if values:
+            result[f"{stage}_p50_ms"] = round(percentile(values, 50) * 1000, 1)
+            result[f"{stage}_p95_ms"] = round(percentile(values, 95) * 1000, 1)
+            result[f"{stage}_mean_ms"] = round(statistics.mean(values) * 1000, 1)
+    result["submits_per_s"] = round(len(samples["submit"]) / elapsed, 3)
+    result["rss_mb"] = round(rss_bytes() / 1048576, 1)
+    result["peak_rss_mb"] = round(memory.peak / 1048576, 1)
+    return result, failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", default="1,2,4,8", help="Comma separated concurrency levels")
+    parser.add_argument("--rounds", type=int, default=2, help="Stories each session submits per level")
+    parser.add_argument("--pages", type=int, default=8, help="Slides per story")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Mock LLM seconds per call")
+    parser.add_argument("--image-latency", type=float, default=0.05, help="Image origin seconds per response")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds allowed per rerun")
+    parser.add_argument("--data-dir", help="Keep the app's files here instead of a temp directory")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="bench-sessions-")
+    origin_server, origin = start_origin(args.image_latency)
+    share_runtime(app_secrets(data_dir, args.llm_latency))
+
+    try:
+        # Cold start: the first session builds every cached resource
+        started = time.perf_counter()
+        _, problems = run_session("warmup", origin, args.pages, args.timeout, "warmup")
+        print(f"Cold start session: {time.perf_counter() - started:.2f}s, RSS {rss_bytes() / 1048576:.1f} MB")
+        for problem in problems:
+            print(f"  ! {problem}")
+
+        results = []
+        print(
+            f"{'sessions':>8} {'submits':>7} {'fail':>4} {'load p50':>9} {'load p95':>9} {'meta p50':>9} {'meta p95':>9} "
+            f"{'submit p50':>11} {'submit p95':>11} {'submits/s':>10} {'RSS MB':>7} {'peak MB':>8}"
+        )
+        for level, concurrency in enumerate(int(value) for value in args.sessions.split(",")):
+            result, failures = run_level(concurrency, args.rounds, origin, args.pages, args.timeout, f"l{level}")
+            results.append(result)
+            print(
+                f"{result['sessions']:>8} {result['submits']:>7} {result['failures']:>4} "
+                f"{result.get('load_p50_ms', '-'):>9} {result.get('load_p95_ms', '-'):>9} "
+                f"{result.get('metadata_p50_ms', '-'):>9} {result.get('metadata_p95_ms', '-'):>9} "
+                f"{result.get('submit_p50_ms', '-'):>11} {result.get('submit_p95_ms', '-'):>11} "
+                f"{result['submits_per_s']:>10} {result['rss_mb']:>7} {result['peak_rss_mb']:>8}"
+            )
+            for failure in failures[:5]:
+                print(f"  ! {failure}")
+    finally:
+        origin_server.shutdown()
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    return 1 if any(result["failures"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
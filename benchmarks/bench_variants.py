@@ -0,0 +1,53 @@
+# Throughput of local resize-variant generation (images per second) as the
+# process pool grows from one worker to every core.
+#
+#   python benchmarks/bench_variants.py --images 48 --size 2400x3200
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from image_variants import DEFAULT_RESIZE_PRESETS  # noqa: E402
+from local_variants import available_formats, generate_variants_batch, shutdown_pool  # noqa: E402
+
+
+def synthetic_jpeg(width, height, seed):
+    im = Image.effect_noise((width // 8, height // 8), 64 + seed % 64).convert("RGB")
+    im = im.resize((width, height), Image.BILINEAR)
+    out = BytesIO()
+    im.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--size", default="2400x3200")
+    parser.add_argument("--formats", default=",".join(available_formats()))
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split("x"))
+    formats = tuple(args.formats.split(","))
+    images = [synthetic_jpeg(width, height, i) for i in range(args.images)]
+
+    workers = 1
+    while True:
+        # One warm-up image so spawn start-up is not counted
+        generate_variants_batch(images[:1], DEFAULT_RESIZE_PRESETS, formats, max_workers=workers)
+        started = time.perf_counter()
+        generate_variants_batch(images, DEFAULT_RESIZE_PRESETS, formats, max_workers=workers)
+        elapsed = time.perf_counter() - started
+        print(f"workers={workers:<3} {args.images / elapsed:8.2f} images/s  ({elapsed:.2f}s, formats={','.join(formats)})")
+        if workers >= os.cpu_count():
+            break
+        workers = min(workers * 2, os.cpu_count())
+        shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
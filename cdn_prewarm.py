@@ -0,0 +1,67 @@
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from http_client import fetch
+
+SRCSET_RE = re.compile(r'\ssrcset="([^"]+)"')
+
+# Shared pool so prewarming never blocks the script thread
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cdn-prewarm")
+
+
+# Every CDN URL in srcset attributes, plus any extra URLs (e.g. the cover variants)
+def collect_variant_urls(html, extra_urls=(), cdn_prefix="https://"):
+    urls = list(extra_urls)
+    for match in SRCSET_RE.finditer(html):
+        for candidate in match.group(1).split(","):
+            candidate = candidate.strip()
+            if candidate:
+                urls.append(candidate.split()[0])
+    return [url for url in dict.fromkeys(urls) if url.startswith(cdn_prefix)]
+
+
+def _fetch(url, timeout):
+    started = time.monotonic()
+    try:
+        response = fetch(url, timeout, stream=True)
+        size = sum(len(chunk) for chunk in response.iter_content(64 * 1024))
+        response.close()
+        return {
+            "url": url,
+            "status": response.status_code,
+            "seconds": round(time.monotonic() - started, 3),
+            "bytes": size,
+            "cache": response.headers.get("X-Cache", response.headers.get("Age", "")),
+        }
+    except requests.RequestException as e:
+        return {"url": url, "status": f"error: {e}", "seconds": round(time.monotonic() - started, 3), "bytes": 0, "cache": ""}
+
+
+# Request every URL once with bounded concurrency and an overall time budget.
+# URLs not finished within the budget are reported with status "skipped".
+def prewarm(urls, max_workers=8, budget=20.0, timeout=10.0):
+    deadline = time.monotonic() + budget
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cdn-prewarm-fetch")
+    try:
+        pending = {executor.submit(_fetch, url, min(timeout, budget)): url for url in urls}
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [
+        results.get(url, {"url": url, "status": "skipped", "seconds": None, "bytes": 0, "cache": ""})
+        for url in urls
+    ]
+
+
+def start_prewarm(urls, **kwargs):
+    return _background.submit(prewarm, list(urls), **kwargs)
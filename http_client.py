@@ -0,0 +1,253 @@
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from pipeline_timing import METRICS
+
+# Outbound HTTP for image and media fetches: one keep-alive connection pool per
+# host shared by every session and thread, an optional overall deadline per
+# submit, optional hedged GETs, and per-host latency percentiles.
+
+POOL_HOSTS = 32
+POOL_SIZE = 16
+LATENCY_WINDOW = 512
+# Hedging waits at least this long, even for hosts that are usually faster
+MIN_HEDGE_DELAY = 0.05
+HEDGE_SAMPLES = 20
+# Hosts that get their own stage label in /metrics. Image URLs come from editors,
+# so every other host is exported as "other" rather than as a new time series
+# each; the per-host table in the app still lists them all.
+METRIC_HOSTS = frozenset({"media.suvichaar.org", "stories.suvichaar.org", "res.cloudinary.com"})
+
+_session = None
+_session_lock = threading.Lock()
+# Only the second GET of a hedged fetch runs here; the first runs on the caller's thread
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="http-hedge")
+# The hedge race of the fetch the current thread is making, if any
+_racing = threading.local()
+
+
+class DeadlineExceeded(requests.Timeout):
+    pass
+
+
+# Connections that register with the current thread's hedge race while they wait
+# for response headers, so a hedge that answers first can cut them off
+class _RaceConnectionMixin:
+    def getresponse(self, *args, **kwargs):
+        race = getattr(_racing, "race", None)
+        if race is not None:
+            race.attach(self)
+        return super().getresponse(*args, **kwargs)
+
+
+class _RaceHTTPConnection(_RaceConnectionMixin, HTTPConnection):
+    pass
+
+
+class _RaceHTTPSConnection(_RaceConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _RaceHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _RaceHTTPConnection
+
+
+class _RaceHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _RaceHTTPSConnection
+
+
+class _Adapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _RaceHTTPConnectionPool, "https": _RaceHTTPSConnectionPool}
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = _Adapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+# Time budget shared by every fetch of one submit
+class Deadline:
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    # Per-request timeout: `cap`, shortened to what is left of the budget
+    def timeout(self, cap):
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Fetch budget for this submit is used up")
+        if isinstance(cap, tuple):
+            return tuple(min(part, remaining) for part in cap)
+        return min(cap, remaining)
+
+
+# Rolling per-host latencies (time to response headers) and outcomes
+class HostLatency:
+    def __init__(self, window=LATENCY_WINDOW, metrics=METRICS, metric_hosts=METRIC_HOSTS):
+        self.window = window
+        self.metrics = metrics
+        self.metric_hosts = metric_hosts
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, host):
+        return self._hosts.setdefault(host, {"samples": deque(maxlen=self.window), "count": 0, "errors": 0, "hedged": 0})
+
+    def observe(self, host, seconds, error=False):
+        with self._lock:
+            entry = self._entry(host)
+            entry["count"] += 1
+            entry["errors"] += error
+            if not error:
+                entry["samples"].append(seconds)
+        self.metrics.observe("fetch", host if host in self.metric_hosts else "other", seconds)
+
+    def observe_hedge(self, host):
+        with self._lock:
+            self._entry(host)["hedged"] += 1
+
+    def percentile(self, host, pct):
+        with self._lock:
+            entry = self._hosts.get(host)
+            samples = sorted(entry["samples"]) if entry else []
+        if len(samples) < HEDGE_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, round(pct / 100 * (len(samples) - 1)))]
+
+    def snapshot(self):
+        rows = []
+        with self._lock:
+            hosts = {host: (sorted(entry["samples"]), dict(entry)) for host, entry in self._hosts.items()}
+        for host, (samples, entry) in sorted(hosts.items()):
+            def pct(p):
+                return round(samples[min(len(samples) - 1, round(p / 100 * (len(samples) - 1)))] * 1000, 1) if samples else None
+            rows.append({
+                "host": host, "requests": entry["count"], "errors": entry["errors"], "hedged": entry["hedged"],
+                "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            })
+        return rows
+
+
+HOST_LATENCY = HostLatency()
+
+
+def _get(url, timeout, headers, stream, race=None):
+    host = urlparse(url).netloc
+    started = time.perf_counter()
+    _racing.race = race
+    try:
+        response = get_session().get(url, headers=headers, timeout=timeout, stream=stream)
+    except requests.RequestException:
+        # A request cut off by the winning hedge is not an error of the host
+        if race is None or race.winner != "hedge":
+            HOST_LATENCY.observe(host, time.perf_counter() - started, error=True)
+        raise
+    finally:
+        _racing.race = None
+    HOST_LATENCY.observe(host, time.perf_counter() - started, error=response.status_code >= 500)
+    return response
+
+
+# First GET (caller's thread) against the hedge (pool), decided under one lock:
+# whichever gets its response first wins; a winning hedge shuts down the socket
+# the first is still waiting on, and the losing response is closed.
+class _Race:
+    def __init__(self):
+        self.winner = None
+        self.first_done = False
+        self.hedge = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def attach(self, connection):
+        with self._lock:
+            if self.winner == "hedge":
+                raise ConnectionAbortedError("The hedged request answered first")
+            self._connection = connection
+
+    # Timer thread: send the hedge unless the first request has finished
+    def start_hedge(self, url, timeout, headers):
+        with self._lock:
+            if self.first_done:
+                return
+            self.hedge = _hedge_pool.submit(self._run_hedge, url, timeout, headers)
+        HOST_LATENCY.observe_hedge(urlparse(url).netloc)
+
+    def _run_hedge(self, url, timeout, headers):
+        response = _get(url, timeout, headers, True)
+        with self._lock:
+            if self.winner is None:
+                self.winner = "hedge"
+                if self._connection is not None and self._connection.sock is not None:
+                    try:
+                        self._connection.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                return response
+        response.close()
+        return None
+
+    # Caller's thread, once the first GET has returned (True if it won) or failed
+    def finish_first(self, succeeded):
+        with self._lock:
+            self.first_done = True
+            self._connection = None
+            if succeeded and self.winner is None:
+                self.winner = "first"
+            return self.winner == "first"
+
+
+# GET through the shared pool. `deadline` caps the timeout; `hedge_after` (seconds,
+# or "auto" for the host's p95) sends a second identical GET if the first has not
+# answered by then, and returns whichever answers first.
+def fetch(url, timeout=10, headers=None, stream=False, deadline=None, hedge_after=None):
+    if deadline is not None:
+        timeout = deadline.timeout(timeout)
+    if hedge_after == "auto":
+        hedge_after = HOST_LATENCY.percentile(urlparse(url).netloc, 95)
+        hedge_after = max(hedge_after, MIN_HEDGE_DELAY) if hedge_after is not None else None
+    if not hedge_after:
+        return _get(url, timeout, headers, stream)
+
+    # Both GETs stream, so the race is decided on response headers; the body of
+    # the winner is read afterwards unless the caller asked to stream it
+    race = _Race()
+    timer = threading.Timer(hedge_after, race.start_hedge, (url, timeout, headers))
+    timer.daemon = True
+    timer.start()
+    try:
+        response = _get(url, timeout, headers, True, race)
+    except requests.RequestException:
+        timer.cancel()
+        race.finish_first(False)
+        if race.hedge is None:
+            raise
+        response = race.hedge.result()
+    else:
+        timer.cancel()
+        if not race.finish_first(True):
+            response.close()
+            response = race.hedge.result()
+    if not stream:
+        response.content
+    return response
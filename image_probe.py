@@ -0,0 +1,188 @@
+import re
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from http_client import fetch
+
+FIRST_BYTES = 4096
+# An EXIF block with its thumbnail can be up to 64 KB before the frame header
+MAX_BYTES = 262144
+CACHE_SIZE = 4096
+_probe_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class ProbeError(Exception):
+    pass
+
+
+# (format, width, height) from the first bytes of an image, or None if more bytes are needed
+def parse_dimensions(head):
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and len(head) >= 24:
+        width, height = struct.unpack(">II", head[16:24])
+        return "png", width, height
+    if head[:6] in (b"GIF87a", b"GIF89a") and len(head) >= 10:
+        width, height = struct.unpack("<HH", head[6:10])
+        return "gif", width, height
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", head[26:30])
+            return "webp", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(head[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return "webp", int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis"):
+        ispe = head.find(b"ispe")
+        if ispe != -1 and len(head) >= ispe + 16:
+            width, height = struct.unpack(">II", head[ispe + 8:ispe + 16])
+            return "avif", width, height
+        return None
+    if head[:2] == b"\xff\xd8":
+        return _jpeg_dimensions(head)
+    if len(head) >= 32:
+        raise ProbeError("Unrecognised image format")
+    return None
+
+
+# EXIF Orientation (1-8) from an APP1 segment's data, or 1 if it has none
+def _exif_orientation(data):
+    if data[:6] != b"Exif\x00\x00":
+        return 1
+    tiff = data[6:]
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None:
+        return 1
+    ifd = struct.unpack(order + "I", tiff[4:8])[0]
+    count = struct.unpack(order + "H", tiff[ifd:ifd + 2])[0]
+    for entry in range(ifd + 2, ifd + 2 + 12 * count, 12):
+        if struct.unpack(order + "H", tiff[entry:entry + 2])[0] == 0x0112:
+            return struct.unpack(order + "H", tiff[entry + 8:entry + 10])[0]
+    return 1
+
+
+# Size as displayed: orientations 5-8 rotate the stored frame by 90 degrees,
+# so a portrait phone photo stored landscape gets its width and height swapped
+def _jpeg_dimensions(head):
+    pos = 2
+    orientation = 1
+    while pos + 9 < len(head):
+        if head[pos] != 0xFF:
+            raise ProbeError("Corrupt JPEG marker stream")
+        marker = head[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = struct.unpack(">H", head[pos + 2:pos + 4])[0]
+        if marker == 0xE1 and orientation == 1:
+            if pos + 2 + length > len(head):
+                # EXIF (with its thumbnail) runs past what we have; read more
+                return None
+            orientation = _exif_orientation(head[pos + 4:pos + 2 + length])
+        # SOF0..SOF15 carry the frame size; C4/C8/CC are DHT/JPG/DAC
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", head[pos + 5:pos + 9])
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+            return "jpeg", width, height
+        pos += 2 + length
+    return None
+
+
+def _read_head(url, size, timeout, deadline=None, hedge_after=None):
+    response = fetch(
+        url, timeout, headers={"Range": f"bytes=0-{size - 1}"}, stream=True, deadline=deadline, hedge_after=hedge_after
+    )
+    try:
+        response.raise_for_status()
+        # Servers that ignore Range still only get read for `size` bytes
+        head = b""
+        for chunk in response.iter_content(size):
+            head += chunk
+            if len(head) >= size:
+                break
+        return head[:size]
+    finally:
+        response.close()
+
+
+# Cached per URL; failures raise and are therefore not cached
+def _probe(url, timeout, deadline, hedge_after):
+    with _cache_lock:
+        if url in _probe_cache:
+            _probe_cache.move_to_end(url)
+            return _probe_cache[url]
+    size = FIRST_BYTES
+    while True:
+        head = _read_head(url, size, timeout, deadline, hedge_after)
+        result = parse_dimensions(head)
+        if result:
+            break
+        if len(head) < size or size >= MAX_BYTES:
+            raise ProbeError("Image dimensions not found in header")
+        size *= 4
+    with _cache_lock:
+        _probe_cache[url] = result
+        if len(_probe_cache) > CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return result
+
+
+def probe_image(url, timeout=5, deadline=None, hedge_after=None):
+    try:
+        return _probe(url, timeout, deadline, hedge_after)
+    except (ProbeError, requests.RequestException, struct.error):
+        return None
+
+
+def _attr(tag, name):
+    match = re.search(rf'\s{name}="([^"]*)"', tag)
+    return match.group(1) if match else None
+
+
+# Fill width/height (and a responsive layout) on <amp-img> tags that lack them.
+# Images are probed in parallel and only their first few KB are read.
+def fill_tag_dimensions(tags, max_workers=8, timeout=5, deadline=None, hedge_after=None):
+    todo = {}
+    for tag in tags:
+        src = _attr(tag, "src")
+        if not src or not src.startswith("http") or _attr(tag, "layout") in ("fill", "nodisplay"):
+            continue
+        if _attr(tag, "width") is None or _attr(tag, "height") is None:
+            todo[src] = None
+    if not todo:
+        return list(tags)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for src, result in zip(todo, executor.map(lambda u: probe_image(u, timeout, deadline, hedge_after), todo)):
+            todo[src] = result
+
+    def fill(tag):
+        result = todo.get(_attr(tag, "src"))
+        if not result:
+            return tag
+        _, width, height = result
+        if not width or not height:
+            return tag
+        width_attr, height_attr = _attr(tag, "width"), _attr(tag, "height")
+        extra = ""
+        if width_attr is None and height_attr is None:
+            extra += f' width="{width}" height="{height}"'
+        elif width_attr is None and height_attr.isdigit():
+            extra += f' width="{round(int(height_attr) * width / height)}"'
+        elif height_attr is None and width_attr.isdigit():
+            extra += f' height="{round(int(width_attr) * height / width)}"'
+        else:
+            return tag
+        if _attr(tag, "layout") is None:
+            extra += ' layout="responsive"'
+        end = len(tag) - 2 if tag.endswith("/>") else len(tag) - 1
+        return tag[:end] + extra + tag[end:]
+
+    return [fill(tag) for tag in tags]
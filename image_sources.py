@@ -0,0 +1,102 @@
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+from media_rehost import rehost_media
+
+MEDIA_CDN = "https://media.suvichaar.org/"
+# Sources that can be resized get every configured preset
+ALL_VARIANTS = "*"
+MEDIA_SRC_RE = re.compile(rb'<(?:amp-video|amp-audio|source)\b[^>]*?\s(?:src|poster)="(https?://[^"]+)"', re.IGNORECASE)
+
+
+# An image source we know how to handle without guessing.
+# on_cdn sources are already served by us and are never downloaded again;
+# key_for maps the URL to its bucket key and public_url to the URL used as {{image0}};
+# variants is a tuple of preset labels, or ALL_VARIANTS.
+@dataclass(frozen=True)
+class ImageSource:
+    name: str
+    prefixes: tuple
+    on_cdn: bool
+    key_for: object = None
+    public_url: object = None
+    variants: tuple = ()
+
+    def matches(self, url):
+        return url.startswith(self.prefixes)
+
+
+IMAGE_SOURCES = []
+
+
+def register_source(source):
+    IMAGE_SOURCES.append(source)
+    return source
+
+
+def _path_key(url):
+    return urlparse(url).path.lstrip("/")
+
+
+register_source(ImageSource(
+    name="suvichaar-media",
+    prefixes=("http://media.suvichaar.org", "https://media.suvichaar.org"),
+    on_cdn=True,
+    key_for=_path_key,
+    public_url=lambda url, key: url,
+    variants=ALL_VARIANTS,
+))
+
+# stories.suvichaar.org/<bucket-folder>/<key>: drop the first path segment
+register_source(ImageSource(
+    name="suvichaar-stories",
+    prefixes=("https://stories.suvichaar.org/",),
+    on_cdn=True,
+    key_for=lambda url: "/".join(urlparse(url).path.split("/")[2:]),
+    public_url=lambda url, key: url,
+))
+
+# Anything else is downloaded once and re-hosted in our bucket. That includes
+# Cloudinary: its uploads are not mirrored into media/, so they need a copy too.
+REHOST_SOURCE = ImageSource(name="rehost", prefixes=(), on_cdn=False, variants=ALL_VARIANTS)
+
+
+def resolve_source(url):
+    for source in IMAGE_SOURCES:
+        if source.matches(url):
+            return source
+    return REHOST_SOURCE
+
+
+def image_extension(url):
+    ext = os.path.splitext(os.path.basename(urlparse(url).path))[1].lower()
+    return ext if ext in [".jpg", ".jpeg", ".png", ".gif"] else ".jpg"
+
+
+# External media URLs in the slides (bytes), in order of first use. Anything a
+# registered source already serves from the CDN is left alone.
+def external_media_urls(html):
+    urls = []
+    for match in MEDIA_SRC_RE.finditer(html):
+        url = match.group(1).decode("utf-8", "replace").replace("&amp;", "&")
+        if url not in urls and not resolve_source(url).on_cdn:
+            urls.append(url)
+    return urls
+
+
+# Resolve an image URL to (source, bucket key, public URL).
+# Known CDN sources return immediately; only unknown sources are fetched and uploaded.
+def prepare_image(url, s3_client, bucket, s3_prefix, cdn_base_url, deadline=None, hedge_after=None):
+    source = resolve_source(url)
+    if source.on_cdn:
+        key = source.key_for(url)
+        return source, key, source.public_url(url, key)
+
+    key = f"{s3_prefix}{uuid.uuid4().hex}{image_extension(url)}"
+    key = rehost_media(
+        url, s3_client, bucket, key, default_type="image/jpeg", timeout=10, deadline=deadline, hedge_after=hedge_after
+    )["key"]
+    return source, key, f"{cdn_base_url}{key}"
@@ -0,0 +1,111 @@
+import base64
+import json
+import re
+from functools import lru_cache
+
+from image_sources import ALL_VARIANTS, MEDIA_CDN, resolve_source
+
+# label -> (width, height, fit); overridable through the RESIZE_PRESETS secret
+DEFAULT_RESIZE_PRESETS = {
+    "potraitcoverurl": (640, 853, "cover"),
+    "msthumbnailcoverurl": (300, 300, "cover"),
+}
+DEFAULT_SRCSET_WIDTHS = (320, 640, 960, 1280)
+
+SRC_RE = re.compile(r'\ssrc="([^"]+)"')
+
+
+# Accepts {"label": [w, h]}, {"label": [w, h, fit]} or {"label": {"width": .., "height": .., "fit": ..}}
+def load_resize_presets(config=None):
+    if not config:
+        return dict(DEFAULT_RESIZE_PRESETS)
+    presets = {}
+    for label, value in config.items():
+        if isinstance(value, dict):
+            presets[label] = (int(value["width"]), int(value["height"]), value.get("fit", "cover"))
+        else:
+            width, height, *rest = value
+            presets[label] = (int(width), int(height), rest[0] if rest else "cover")
+    return presets
+
+
+# One encoded resize URL; memoized per (bucket, key, size) across submits and sessions
+@lru_cache(maxsize=8192)
+def variant_url(bucket, key, width, height=None, fit="cover", cdn_prefix=MEDIA_CDN):
+    resize = {"width": width}
+    if height is not None:
+        resize["height"] = height
+    resize["fit"] = fit
+    template = {"bucket": bucket, "key": key, "edits": {"resize": resize}}
+    encoded = base64.urlsafe_b64encode(json.dumps(template).encode()).decode()
+    return f"{cdn_prefix}{encoded}"
+
+
+def build_variants(bucket, key, presets, labels=ALL_VARIANTS):
+    if labels == ALL_VARIANTS:
+        labels = presets.keys()
+    return {
+        label: variant_url(bucket, key, *presets[label])
+        for label in labels
+        if label in presets
+    }
+
+
+# {(bucket, key): {label: url}} for many images in one call; repeated images are built once
+def build_variants_batch(images, presets, labels=ALL_VARIANTS):
+    return {image: build_variants(*image, presets, labels) for image in dict.fromkeys(images)}
+
+
+# srcset candidates as presets: "<width>w" -> width-only resize that keeps the aspect ratio
+def srcset_presets(widths=DEFAULT_SRCSET_WIDTHS):
+    return {f"{width}w": (width, None, "inside") for width in widths}
+
+
+def build_srcset(variants):
+    return ", ".join(f"{url} {label}" for label, url in variants.items())
+
+
+# (bucket, key) of the original object behind a CDN image path, or None when the
+# path is not a plain key: a filters: URL, or an encoded edits request that does
+# more than resize (srcset widths of the original would drop a crop or rotate)
+def original_object(key, bucket):
+    if key.startswith("filters:"):
+        return None
+    if "/" in key or "." in key:
+        return bucket, key
+    try:
+        template = json.loads(base64.urlsafe_b64decode(key + "=" * (-len(key) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(template, dict) or not template.get("key") or set(template.get("edits") or {}) - {"resize"}:
+        return None
+    return template.get("bucket", bucket), template["key"]
+
+
+# (src match, original object) for a slide <amp-img> tag whose src is a resizable
+# image on our CDN, or None
+def _srcset_target(tag, bucket):
+    src = SRC_RE.search(tag)
+    if not src or "srcset=" in tag:
+        return None
+    source = resolve_source(src.group(1))
+    if not source.on_cdn or not source.variants:
+        return None
+    original = original_object(source.key_for(src.group(1)), bucket)
+    return (src, original) if original is not None else None
+
+
+# Slide <amp-img> tags with a srcset added where the src is a resizable image on
+# our CDN; the srcset variants of every image are built in one batch. Other tags
+# come back unchanged.
+def add_srcsets(tags, bucket, widths=DEFAULT_SRCSET_WIDTHS):
+    targets = [_srcset_target(tag, bucket) for tag in tags]
+    variants = build_variants_batch([target[1] for target in targets if target], srcset_presets(widths))
+    tagged = []
+    for tag, target in zip(tags, targets):
+        if target is None:
+            tagged.append(tag)
+            continue
+        src, original = target
+        tagged.append(f'{tag[:src.end()]} srcset="{build_srcset(variants[original])}"{tag[src.end():]}')
+    return tagged
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Accounting and caching around chat.completions.create. Every call is recorded
+# (tokens from response.usage, latency, model, cache outcome) in a local SQLite
+# file, with a per-day rollup table kept up to date on insert.
+
+CACHE_SIZE = 512
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    ts TEXT NOT NULL,
+    day TEXT NOT NULL,
+    purpose TEXT NOT NULL,
+    editor TEXT NOT NULL,
+    story TEXT,
+    model TEXT,
+    cache TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS llm_calls_day ON llm_calls (day);
+CREATE TABLE IF NOT EXISTS llm_daily (
+    day TEXT NOT NULL,
+    purpose TEXT NOT NULL,
+    editor TEXT NOT NULL,
+    model TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    cache_hits INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (day, purpose, editor, model)
+);
+"""
+
+ROLLUP_UPSERT = """
+INSERT INTO llm_daily VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (day, purpose, editor, model) DO UPDATE SET
+    calls = calls + 1,
+    cache_hits = cache_hits + excluded.cache_hits,
+    errors = errors + excluded.errors,
+    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+    completion_tokens = completion_tokens + excluded.completion_tokens,
+    seconds = seconds + excluded.seconds
+"""
+
+
+class UsageStore:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def record(self, purpose, editor, story, model, cache, prompt_tokens, completion_tokens, seconds, error=None):
+        now = datetime.now(timezone.utc)
+        day = now.date().isoformat()
+        editor = editor or "anonymous"
+        model = model or ""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO llm_calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now.isoformat(), day, purpose, editor, story, model, cache, prompt_tokens, completion_tokens, seconds, error),
+            )
+            self._db.execute(
+                ROLLUP_UPSERT,
+                (day, purpose, editor, model, int(cache == "hit"), int(error is not None), prompt_tokens, completion_tokens, seconds),
+            )
+
+    # Per-day totals, newest first, as dicts
+    def daily(self, days=7):
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT day, purpose, editor, model, calls, cache_hits, errors, prompt_tokens, completion_tokens,"
+                " ROUND(seconds, 3) AS seconds FROM llm_daily WHERE day >= date('now', ?) ORDER BY day DESC, purpose, editor",
+                (f"-{days - 1} days",),
+            )
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    # Per-story totals for the given day (default today)
+    def by_story(self, day=None):
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT story, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens,"
+                " SUM(completion_tokens) AS completion_tokens, ROUND(SUM(seconds), 3) AS seconds"
+                " FROM llm_calls WHERE day = ? AND story IS NOT NULL GROUP BY story ORDER BY calls DESC",
+                (day or datetime.now(timezone.utc).date().isoformat(),),
+            )
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+# In-memory LRU of responses by request, with a time to live
+class ResponseCache:
+    def __init__(self, ttl, size=CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kwargs):
+        return hashlib.sha256(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored, response = entry
+            if time.monotonic() - stored > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), response)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+# Drop-in for a client's chat.completions: `llm.chat.completions.create(...)` with
+# the usual arguments, plus purpose / editor / story for the accounting and
+# use_cache=False to always call the backend.
+class AccountedLLM:
+    def __init__(self, backend, store=None, cache=None):
+        self.backend = backend
+        self.store = store
+        self.cache = cache
+        self.chat = self
+        self.completions = self
+
+    def create(self, purpose="chat", editor=None, story=None, use_cache=True, **kwargs):
+        cache_key = self.cache.key(kwargs) if self.cache is not None and use_cache else None
+        started = time.perf_counter()
+        response = self.cache.get(cache_key) if cache_key else None
+        outcome = "hit" if response is not None else ("miss" if cache_key else "off")
+        error = None
+        try:
+            if response is None:
+                response = self.backend.chat.completions.create(**kwargs)
+                if cache_key:
+                    self.cache.put(cache_key, response)
+            return response
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if self.store is not None:
+                # A cache hit spends no tokens
+                usage = getattr(response, "usage", None) if outcome != "hit" else None
+                self.store.record(
+                    purpose, editor, story, getattr(response, "model", None) or kwargs.get("model"), outcome,
+                    getattr(usage, "prompt_tokens", None) or 0, getattr(usage, "completion_tokens", None) or 0,
+                    round(time.perf_counter() - started, 6), error,
+                )
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from io import BytesIO
+
+
+# Stand-in for the boto3 S3 client calls this app makes, for benchmarks and
+# offline runs. Objects live in memory, or under `root` as root/<bucket>/<key>.
+class LocalS3Client:
+    def __init__(self, root=None):
+        self.root = root
+        self.objects = {}
+        self.uploads = {}
+        self._lock = threading.Lock()
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def put_object(self, Bucket, Key, Body, ContentType="binary/octet-stream", **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        if self.root:
+            path = self._path(Bucket, Key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(Body)
+        with self._lock:
+            self.objects[(Bucket, Key)] = (None if self.root else Body, ContentType, len(Body))
+        return {"ETag": f'"{len(Body):x}"'}
+
+    def _lookup(self, Bucket, Key):
+        with self._lock:
+            entry = self.objects.get((Bucket, Key))
+        if entry is None and self.root and os.path.exists(self._path(Bucket, Key)):
+            entry = (None, "binary/octet-stream", os.path.getsize(self._path(Bucket, Key)))
+        if entry is None:
+            raise KeyError(f"NoSuchKey: s3://{Bucket}/{Key}")
+        return entry
+
+    def head_object(self, Bucket, Key):
+        _, content_type, size = self._lookup(Bucket, Key)
+        return {"ContentType": content_type, "ContentLength": size}
+
+    def get_object(self, Bucket, Key):
+        body, content_type, size = self._lookup(Bucket, Key)
+        if body is None:
+            with open(self._path(Bucket, Key), "rb") as file:
+                body = file.read()
+        return {"Body": BytesIO(body), "ContentType": content_type, "ContentLength": size}
+
+    # Multipart uploads: parts are held in memory until completed
+    def create_multipart_upload(self, Bucket, Key, ContentType="binary/octet-stream", **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {
+                "bucket": Bucket, "key": Key, "content_type": ContentType, "parts": {}, "initiated": datetime.now(timezone.utc),
+            }
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def _upload(self, UploadId):
+        upload = self.uploads.get(UploadId)
+        if upload is None:
+            raise KeyError(f"NoSuchUpload: {UploadId}")
+        return upload
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body, **kwargs):
+        body = Body.read() if hasattr(Body, "read") else bytes(Body)
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self._lock:
+            self._upload(UploadId)["parts"][PartNumber] = (etag, body)
+        return {"ETag": etag}
+
+    def list_parts(self, Bucket, Key, UploadId, **kwargs):
+        with self._lock:
+            parts = self._upload(UploadId)["parts"]
+            return {"Parts": [{"PartNumber": number, "ETag": etag, "Size": len(body)} for number, (etag, body) in sorted(parts.items())]}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self._lock:
+            upload = self.uploads.pop(UploadId)
+        chunks = []
+        for part in MultipartUpload["Parts"]:
+            etag, body = upload["parts"][part["PartNumber"]]
+            if etag != part["ETag"]:
+                raise ValueError(f"InvalidPart: {part['PartNumber']}")
+            chunks.append(body)
+        self.put_object(Bucket=Bucket, Key=Key, Body=b"".join(chunks), ContentType=upload["content_type"])
+        return {"Bucket": Bucket, "Key": Key}
+
+    def list_multipart_uploads(self, Bucket, Prefix="", **kwargs):
+        with self._lock:
+            uploads = [
+                {"Key": upload["key"], "UploadId": upload_id, "Initiated": upload["initiated"]}
+                for upload_id, upload in self.uploads.items()
+                if upload["bucket"] == Bucket and upload["key"].startswith(Prefix)
+            ]
+        return {"Uploads": sorted(uploads, key=lambda upload: upload["Key"]), "IsTruncated": False}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
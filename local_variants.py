@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is only needed for offline variant generation
+    Image = None
+
+# format -> (file extension, content type, save options)
+VARIANT_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+    "webp": (".webp", "image/webp", {"quality": 80, "method": 4}),
+    "avif": (".avif", "image/avif", {"quality": 60, "speed": 8}),
+}
+
+# Cover presets fill og:image, twitter:image and the story poster, which take one
+# URL each with no format fallback, so the app makes JPEG only; the other formats
+# are there for comparing encoders in benchmarks/bench_variants.py
+DEFAULT_FORMATS = ("jpeg",)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def available_formats(formats=("jpeg", "webp", "avif")):
+    if Image is None:
+        return ()
+    return tuple(f for f in formats if f != "avif" or features.check("avif"))
+
+
+def _resize(im, width, height, fit):
+    if fit == "cover":
+        return ImageOps.fit(im, (width, height), Image.LANCZOS)
+    resized = im.copy()
+    resized.thumbnail((width, height), Image.LANCZOS)
+    return resized
+
+
+# Decode once, then encode every preset in every format. Runs inside a worker process.
+def render_variants(image_bytes, presets, formats):
+    im = Image.open(BytesIO(image_bytes))
+    if im.format == "JPEG":
+        # Let libjpeg decode at a reduced scale when the original is much larger
+        # (square request, since EXIF rotation may still swap the axes)
+        largest = max(max(w, h) for w, h, _ in presets.values())
+        im.draft("RGB", (largest, largest))
+    im = ImageOps.exif_transpose(im).convert("RGB")
+
+    variants = []
+    for label, (width, height, fit) in presets.items():
+        resized = _resize(im, width, height, fit)
+        for fmt in formats:
+            _, _, options = VARIANT_FORMATS[fmt]
+            out = BytesIO()
+            resized.save(out, fmt.upper(), **options)
+            variants.append((label, fmt, resized.width, resized.height, out.getvalue()))
+    return variants
+
+
+def _render_job(job):
+    return render_variants(*job)
+
+
+# Workers are never forked from the threaded server (a child can inherit a lock
+# another thread held, e.g. logging's or urllib3's, and hang on it). They come
+# from a forkserver with this module preloaded, or are spawned where there is
+# none.
+def _get_pool(max_workers=None):
+    global _pool
+    if _pool is None:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+        else:
+            context = multiprocessing.get_context("spawn")
+        _pool = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=context)
+    return _pool
+
+
+# Streamlit runs the app script as the __main__ module, and a new worker re-runs
+# __main__ on start-up; workers start while jobs are submitted, so submits show
+# them a blank __main__ instead
+@contextmanager
+def _blank_main():
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+# Variants for many images at once; one list of (label, format, width, height, bytes) per image
+def generate_variants_batch(images, presets, formats=None, max_workers=None):
+    if Image is None:
+        raise RuntimeError("Pillow is required for local variant generation")
+    formats = formats or DEFAULT_FORMATS
+    jobs = [(image_bytes, presets, formats) for image_bytes in images]
+    if max_workers == 1:
+        return [_render_job(job) for job in jobs]
+    with _pool_lock, _blank_main():
+        futures = [_get_pool(max_workers).submit(_render_job, job) for job in jobs]
+    return [future.result() for future in futures]
+
+
+# Upload variants next to the original key; returns {label: url}, for the first format when there are several
+def upload_variants(s3_client, bucket, key, variants, cdn_base_url):
+    stem = os.path.splitext(key)[0]
+    urls = {}
+    for label, fmt, width, height, body in variants:
+        ext, content_type, _ = VARIANT_FORMATS[fmt]
+        variant_key = f"{stem}_{label}_{width}x{height}{ext}"
+        s3_client.put_object(Bucket=bucket, Key=variant_key, Body=body, ContentType=content_type)
+        urls.setdefault(label, f"{cdn_base_url}{variant_key}")
+    return urls
@@ -0,0 +1,328 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+
+from http_client import fetch
+
+# Re-hosting of external media (mostly <amp-video> sources) in our bucket. Small
+# files are one GET and one put_object. Large files that the origin serves with
+# byte ranges are fetched in parallel ranged GETs and sent as an S3 multipart
+# upload; finished parts are recorded in a state file, so a retry after a failure
+# or timeout only fetches the parts that are still missing. The state file also
+# records the origin's ETag/Last-Modified: a retry against a changed file aborts
+# the old upload and starts over. Large files without byte ranges are streamed
+# into a multipart upload part by part, and aborted if that fails.
+
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+MAX_WORKERS = 6
+PART_ATTEMPTS = 3
+# (connect, read) seconds; the read timeout applies per chunk, not to the whole file
+TIMEOUT = (5, 30)
+STREAM_CHUNK = 1024 * 1024
+# Multipart uploads left this long without being retried are aborted by abort_stale_uploads
+STALE_UPLOAD_SECONDS = 24 * 3600
+# We store the file itself, so ask origins not to compress it: Content-Length and
+# byte ranges then count the bytes we upload
+IDENTITY = {"Accept-Encoding": "identity"}
+
+MEDIA_EXTENSIONS = (".mp4", ".webm", ".m3u8", ".mov", ".mp3", ".m4a", ".ogg", ".jpg", ".jpeg", ".png", ".webp")
+
+
+def media_extension(url):
+    ext = os.path.splitext(os.path.basename(urlparse(url).path))[1].lower()
+    return ext if ext in MEDIA_EXTENSIONS else ".mp4"
+
+
+# Swap re-hosted URLs into the slides (bytes), in plain and &amp;-escaped form
+def rewrite_media_urls(html, replacements):
+    if not replacements:
+        return html
+    encoded = {old.encode("utf-8"): new.encode("utf-8") for old, new in replacements.items()}
+    encoded.update({old.replace(b"&", b"&amp;"): new for old, new in list(encoded.items())})
+    pattern = re.compile(b"|".join(re.escape(old) for old in sorted(encoded, key=len, reverse=True)))
+    return pattern.sub(lambda match: encoded[match.group(0)], html)
+
+
+class _UploadState:
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    self.data = json.load(file)
+            except (OSError, json.JSONDecodeError):
+                self.data = None
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.data, file)
+            os.replace(tmp_path, self.path)
+
+    def part_done(self, number, etag):
+        with self._lock:
+            self.data["parts"][str(number)] = etag
+        self.save()
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _state_path(state_dir, url, bucket):
+    if not state_dir:
+        return None
+    digest = hashlib.sha256(f"{bucket}\n{url}".encode("utf-8")).hexdigest()[:32]
+    return os.path.join(state_dir, f"{digest}.json")
+
+
+# State files in use by a running upload. A second session rehosting the same URL
+# at the same time gets no state file (its upload is not resumable) instead of
+# sharing the first one's upload id and part list.
+_claimed_states = set()
+_claimed_lock = threading.Lock()
+
+
+def _claim_state(path):
+    with _claimed_lock:
+        if not path or path in _claimed_states:
+            return None
+        _claimed_states.add(path)
+        return path
+
+
+def _release_state(path):
+    if path:
+        with _claimed_lock:
+            _claimed_states.discard(path)
+
+
+def _validators(headers):
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+
+# If-Range value for the ranged GETs: an origin whose file changed since the
+# upload started answers 200 with the whole file instead of a stale range
+def _if_range(validators):
+    etag = validators.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return validators.get("last_modified")
+
+
+def _fetch_range(url, start, end, timeout, if_range=None):
+    headers = {**IDENTITY, "Range": f"bytes={start}-{end}"}
+    if if_range:
+        headers["If-Range"] = if_range
+    last_error = None
+    for _ in range(PART_ATTEMPTS):
+        try:
+            response = fetch(url, timeout, headers=headers)
+            if response.status_code != 206:
+                raise IOError(f"Origin changed the file or ignored the byte range (HTTP {response.status_code})")
+            if len(response.content) != end - start + 1:
+                raise IOError(f"Short range read: {len(response.content)} of {end - start + 1} bytes")
+            return response.content
+        except (requests.RequestException, IOError) as e:
+            last_error = e
+    raise last_error
+
+
+# Part numbers already on S3 for a recorded upload, or None if the upload is gone
+def _confirmed_parts(s3_client, bucket, state):
+    try:
+        listed = s3_client.list_parts(Bucket=bucket, Key=state["key"], UploadId=state["upload_id"])
+    except Exception:
+        return None
+    return {str(part["PartNumber"]): part["ETag"] for part in listed.get("Parts", [])}
+
+
+def _abort(s3_client, data):
+    try:
+        s3_client.abort_multipart_upload(Bucket=data["bucket"], Key=data["key"], UploadId=data["upload_id"])
+    except Exception:
+        # Already completed or aborted
+        pass
+
+
+def _multipart(url, s3_client, bucket, key, size, content_type, validators, state, progress, part_size, max_workers, timeout):
+    data = state.data
+    resumed = False
+    if data and data.get("size") == size and data.get("part_size") == part_size and data.get("validators") == validators:
+        confirmed = _confirmed_parts(s3_client, bucket, data)
+        if confirmed is not None:
+            data["parts"] = {number: etag for number, etag in data["parts"].items() if number in confirmed}
+            key = data["key"]
+            resumed = True
+    elif data and data.get("upload_id"):
+        # The origin file changed since the last attempt; its parts are of no use
+        _abort(s3_client, data)
+    if not resumed:
+        upload = s3_client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)
+        state.data = data = {
+            "url": url, "bucket": bucket, "key": key, "upload_id": upload["UploadId"], "size": size,
+            "part_size": part_size, "content_type": content_type, "validators": validators, "parts": {},
+        }
+        state.save()
+
+    ranges = [(number, start, min(start + part_size, size) - 1) for number, start in enumerate(range(0, size, part_size), 1)]
+    missing = [part for part in ranges if str(part[0]) not in data["parts"]]
+    done_bytes = sum(end - start + 1 for number, start, end in ranges if str(number) in data["parts"])
+    if progress:
+        progress(done_bytes, size)
+
+    def transfer(number, start, end):
+        body = _fetch_range(url, start, end, timeout, _if_range(validators))
+        etag = s3_client.upload_part(Bucket=bucket, Key=key, PartNumber=number, UploadId=data["upload_id"], Body=body)["ETag"]
+        state.part_done(number, etag)
+        return len(body)
+
+    try:
+        # Progress is reported from this thread, so callers can update Streamlit elements
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="media-part") as pool:
+            jobs = [pool.submit(transfer, *part) for part in missing]
+            for job in as_completed(jobs):
+                done_bytes += job.result()
+                if progress:
+                    progress(done_bytes, size)
+
+        parts = [{"PartNumber": number, "ETag": data["parts"][str(number)]} for number, _, _ in ranges]
+        s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=data["upload_id"], MultipartUpload={"Parts": parts})
+    except Exception:
+        # Without a state file there is no retry to resume it
+        if not state.path:
+            _abort(s3_client, data)
+        raise
+    state.clear()
+    return {"key": key, "size": size, "content_type": content_type, "parts": len(ranges), "resumed": resumed}
+
+
+# Origins that do not serve byte ranges: up to `threshold` bytes go up with one
+# put_object; a larger file is sent as a multipart upload while it downloads, so
+# memory stays bounded by `threshold`. Such an upload cannot be resumed and is
+# aborted if it fails.
+def _streamed(response, s3_client, bucket, key, size, content_type, progress, threshold, part_size):
+    chunks = response.iter_content(chunk_size=STREAM_CHUNK)
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) > threshold:
+            break
+
+    if len(buffer) <= threshold:
+        response.close()
+        if size and len(buffer) != size:
+            raise IOError(f"Short read: {len(buffer)} of {size} bytes")
+        s3_client.put_object(Bucket=bucket, Key=key, Body=bytes(buffer), ContentType=content_type)
+        if progress:
+            progress(len(buffer), len(buffer))
+        return {"key": key, "size": len(buffer), "content_type": content_type, "parts": 1, "resumed": False}
+
+    data = {"bucket": bucket, "key": key, "upload_id": s3_client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)["UploadId"]}
+    parts = []
+    done_bytes = 0
+
+    def send(body):
+        nonlocal done_bytes
+        number = len(parts) + 1
+        etag = s3_client.upload_part(Bucket=bucket, Key=key, PartNumber=number, UploadId=data["upload_id"], Body=body)["ETag"]
+        parts.append({"PartNumber": number, "ETag": etag})
+        done_bytes += len(body)
+        if progress:
+            progress(done_bytes, max(size, done_bytes))
+
+    try:
+        while True:
+            while len(buffer) >= part_size:
+                send(bytes(buffer[:part_size]))
+                del buffer[:part_size]
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            buffer += chunk
+        if buffer:
+            send(bytes(buffer))
+        if size and done_bytes != size:
+            raise IOError(f"Short read: {done_bytes} of {size} bytes")
+        s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=data["upload_id"], MultipartUpload={"Parts": parts})
+    except Exception:
+        _abort(s3_client, data)
+        raise
+    finally:
+        response.close()
+    return {"key": key, "size": done_bytes, "content_type": content_type, "parts": len(parts), "resumed": False}
+
+
+# Abort multipart uploads under `prefix` that were started more than `max_age`
+# seconds ago, and drop state files untouched for as long: a rehost that failed
+# and was never retried would otherwise keep its parts (billed as storage) in the
+# bucket. Uploads whose state file is still fresh are left for their retry. A
+# bucket lifecycle rule (AbortIncompleteMultipartUpload) does the same
+# server-side where one is configured. Returns the number of uploads aborted.
+def abort_stale_uploads(s3_client, bucket, prefix="", state_dir=None, max_age=STALE_UPLOAD_SECONDS):
+    cutoff = time.time() - max_age
+    active = set()
+    if state_dir and os.path.isdir(state_dir):
+        for filename in os.listdir(state_dir):
+            path = os.path.join(state_dir, filename)
+            if not filename.endswith(".json"):
+                continue
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+            else:
+                active.add((_UploadState(path).data or {}).get("upload_id"))
+
+    aborted = 0
+    request = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        listed = s3_client.list_multipart_uploads(**request)
+        for upload in listed.get("Uploads", []):
+            if upload["UploadId"] not in active and upload["Initiated"].timestamp() < cutoff:
+                s3_client.abort_multipart_upload(Bucket=bucket, Key=upload["Key"], UploadId=upload["UploadId"])
+                aborted += 1
+        if not listed.get("IsTruncated"):
+            return aborted
+        request.update(KeyMarker=listed["NextKeyMarker"], UploadIdMarker=listed["NextUploadIdMarker"])
+
+
+# Copy one external file into the bucket under `key` (a resumed upload keeps the key
+# it started with). `progress(done_bytes, total_bytes)` is called from this thread;
+# `default_type` is used when the origin sends no Content-Type. `deadline` and
+# `hedge_after` apply to the first request (see http_client.fetch).
+# Returns {"key", "size", "content_type", "parts", "resumed"}.
+def rehost_media(url, s3_client, bucket, key, state_dir=None, progress=None, default_type="application/octet-stream",
+                 threshold=MULTIPART_THRESHOLD, part_size=PART_SIZE, max_workers=MAX_WORKERS, timeout=TIMEOUT,
+                 deadline=None, hedge_after=None):
+    response = fetch(url, timeout, headers=IDENTITY, stream=True, deadline=deadline, hedge_after=hedge_after)
+    response.raise_for_status()
+    size = int(response.headers.get("Content-Length") or 0)
+    content_type = response.headers.get("Content-Type") or default_type
+    # An origin that compresses anyway: Content-Length and byte ranges count the
+    # encoded bytes, while iter_content hands us the decoded file
+    if response.headers.get("Content-Encoding", "identity").lower() != "identity":
+        size = 0
+    ranged = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+    if size > threshold and ranged:
+        response.close()
+        state_path = _claim_state(_state_path(state_dir, url, bucket))
+        try:
+            return _multipart(url, s3_client, bucket, key, size, content_type, _validators(response.headers),
+                              _UploadState(state_path), progress, part_size, max_workers, timeout)
+        finally:
+            _release_state(state_path)
+    return _streamed(response, s3_client, bucket, key, size, content_type, progress, threshold, part_size)
@@ -0,0 +1,161 @@
+import gzip
+import json
+import os
+import threading
+
+from append_log import read_json_lines
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Bulk feed of story metadata for downstream ingestion. Every publish appends one
+# JSON line to a live NDJSON file; compaction folds the live lines into a columnar
+# file (Parquet with pyarrow, otherwise gzip JSON with one array per column) holding
+# the latest record per story. A loader reads the columnar file and then the live
+# lines, in one sequential pass each.
+
+LIVE_NAME = "metadata.ndjson"
+COMPACTING_NAME = "metadata.ndjson.compacting"
+PARQUET_NAME = "metadata.parquet"
+COLUMNS_NAME = "metadata.columns.json.gz"
+COMPACT_EVERY = 1000
+
+# Column name -> pyarrow type name; the metadata dict plus the publish times
+FEED_COLUMNS = {
+    "story_uid": "string",
+    "urlslug": "string",
+    "story_title": "string",
+    "categories": "int64",
+    "filterTags": "list",
+    "lang": "string",
+    "keywords": "string",
+    "metadescription": "string",
+    "story_link": "string",
+    "storyhtmlurl": "string",
+    "cover_image_link": "string",
+    "story_logo_link": "string",
+    "publisher_id": "int64",
+    "translations": "map",
+    "publishedtime": "string",
+    "modifiedtime": "string",
+}
+
+
+def _arrow_schema():
+    types = {
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "list": pa.list_(pa.string()),
+        "map": pa.map_(pa.string(), pa.string()),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in FEED_COLUMNS.items()])
+
+
+def feed_record(entry):
+    record = dict(entry.get("metadata") or {})
+    record["publishedtime"] = entry.get("publishedtime", "")
+    record["modifiedtime"] = entry.get("modifiedtime", "")
+    return record
+
+
+def _read_lines(path, repair=False):
+    return (record for _, record in read_json_lines(path, repair))
+
+
+class MetadataFeed:
+    def __init__(self, directory, compact_every=COMPACT_EVERY):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.live_path = os.path.join(directory, LIVE_NAME)
+        self.compacting_path = os.path.join(directory, COMPACTING_NAME)
+        self.columnar_path = os.path.join(directory, PARQUET_NAME if pa else COLUMNS_NAME)
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._live_count = sum(1 for _ in _read_lines(self.live_path, repair=True))
+
+    def is_empty(self):
+        return not any(os.path.exists(path) for path in (self.live_path, self.compacting_path, self.columnar_path))
+
+    # Seed a new feed with stories published before it existed
+    def backfill(self, entries):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.live_path, "a", encoding="utf-8") as file:
+                for entry in entries:
+                    file.write(json.dumps(feed_record(entry), ensure_ascii=False) + "\n")
+                    self._live_count += 1
+        self.compact()
+
+    # Story index listener: one line per publish or update
+    def append(self, entry):
+        line = json.dumps(feed_record(entry), ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.live_path, "a", encoding="utf-8") as file:
+                file.write(line)
+            self._live_count += 1
+            compact_due = self.compact_every and self._live_count >= self.compact_every
+        if compact_due and not self._compact_lock.locked():
+            threading.Thread(target=self.compact, daemon=True, name="feed-compact").start()
+
+    def _read_columnar(self):
+        if not os.path.exists(self.columnar_path):
+            return []
+        if pa:
+            records = pq.read_table(self.columnar_path).to_pylist()
+            for record in records:
+                if record.get("translations") is not None:
+                    record["translations"] = dict(record["translations"])
+            return records
+        with gzip.open(self.columnar_path, "rt", encoding="utf-8") as file:
+            columns = json.load(file)["columns"]
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+    def _write_columnar(self, records):
+        tmp_path = self.columnar_path + ".tmp"
+        if pa:
+            rows = []
+            for record in records:
+                row = {name: record.get(name) for name in FEED_COLUMNS}
+                if row["translations"] is not None:
+                    row["translations"] = list(row["translations"].items())
+                rows.append(row)
+            pq.write_table(pa.Table.from_pylist(rows, schema=_arrow_schema()), tmp_path, compression="zstd")
+        else:
+            columns = {name: [record.get(name) for record in records] for name in FEED_COLUMNS}
+            with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as file:
+                json.dump({"columns": columns}, file, ensure_ascii=False)
+        os.replace(tmp_path, self.columnar_path)
+
+    # Fold the live lines into the columnar file, keeping the latest record per story.
+    # The live file is renamed first, so publishes keep appending to a fresh one; a
+    # compaction cut short leaves the renamed file behind and the next one picks it up.
+    def compact(self):
+        with self._compact_lock:
+            with self._lock:
+                if os.path.exists(self.live_path) and not os.path.exists(self.compacting_path):
+                    os.replace(self.live_path, self.compacting_path)
+                    self._live_count = 0
+            if not os.path.exists(self.compacting_path):
+                return 0
+            by_uid = {record.get("story_uid"): record for record in self._read_columnar()}
+            added = 0
+            for record in _read_lines(self.compacting_path):
+                by_uid[record.get("story_uid")] = record
+                added += 1
+            records = sorted(by_uid.values(), key=lambda record: record.get("publishedtime") or "")
+            self._write_columnar(records)
+            os.remove(self.compacting_path)
+            return added
+
+    # Every story's latest record: the columnar file, then any lines not yet compacted
+    def read_all(self):
+        by_uid = {record.get("story_uid"): record for record in self._read_columnar()}
+        for path in (self.compacting_path, self.live_path):
+            for record in _read_lines(path):
+                by_uid[record.get("story_uid")] = record
+        return list(by_uid.values())
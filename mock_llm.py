@@ -0,0 +1,57 @@
+import random
+import re
+import threading
+import time
+import types
+
+# Offline stand-in for the Azure OpenAI client: same chat.completions.create call
+# shape, canned answers, token counts in response.usage and an optional simulated
+# latency, so the accounting, caching and load tests run without the network.
+
+TITLE_RE = re.compile(r"titled '([^']*)'")
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English prose
+    return max(1, len(text) // 4)
+
+
+class MockLLM:
+    def __init__(self, latency=0.0, jitter=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def _answer(self, prompt):
+        title = TITLE_RE.search(prompt)
+        if title:
+            words = [word for word in re.findall(r"\w+", title.group(1)) if len(word) > 2][:3] or ["story"]
+            return (
+                f"Description: A short story about {title.group(1)}\n"
+                f"Keywords: {', '.join(word.lower() for word in words)}, india\n"
+                f"Filter Tags: {', '.join(word.title() for word in words)}, Culture"
+            )
+        return f"This is a mock answer to: {prompt.strip()[:200]}"
+
+    def create(self, model=None, messages=(), max_tokens=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        content = self._answer(prompt)
+        if max_tokens:
+            content = content[: max_tokens * 4]
+        prompt_tokens = sum(estimate_tokens(str(message.get("content", ""))) + 4 for message in messages)
+        completion_tokens = estimate_tokens(content)
+        return types.SimpleNamespace(
+            model=model,
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(role="assistant", content=content), finish_reason="stop")],
+            usage=types.SimpleNamespace(
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens
+            ),
+        )
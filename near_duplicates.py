@@ -0,0 +1,163 @@
+import hashlib
+import os
+import re
+import struct
+import threading
+from array import array
+
+from append_log import truncate_torn_tail
+
+# MinHash signatures of slide text, with an LSH index over them, so a story that
+# repeats an already published one is flagged before upload.
+#
+# Signatures use one-permutation hashing: every shingle is hashed once and lands in
+# one of NUM_PERM bins, keeping the bin minimum; empty bins borrow the next filled
+# bin's value (rotation densification). Cost is linear in the text, not x NUM_PERM.
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+# Estimated Jaccard of word 3-grams; editing 1 word in 10 already lands near 0.6
+DUPLICATE_THRESHOLD = 0.6
+BIN_BITS = NUM_PERM.bit_length() - 1
+MAX_HASH = 0xFFFFFFFF
+# Added per bin of distance when densifying, so borrowed values differ from the original
+ROTATION_OFFSET = 0x9E3779B1
+
+TAG_RE = re.compile(rb"<[^>]*>")
+SKIP_BLOCK_RE = re.compile(rb"<(style|script)\b[^>]*>.*?</\1>", re.IGNORECASE | re.DOTALL)
+WORD_RE = re.compile(r"[\wऀ-ॿ]+")
+
+RECORD_HEADER = struct.Struct("<H")
+SIGNATURE_BYTES = NUM_PERM * 4
+
+
+# Visible text of the slides (bytes or memoryview of the <amp-story-page> blocks)
+def slide_text(pages):
+    pages = SKIP_BLOCK_RE.sub(b" ", pages)
+    return TAG_RE.sub(b" ", pages).decode("utf-8", "ignore")
+
+
+def shingles(text):
+    words = WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+# NUM_PERM x uint32 MinHash of the shingle set; None when there is no text to compare.
+# blake2b rather than hash(): signatures are persisted, so the hash must be stable.
+def minhash(shingle_set):
+    if not shingle_set:
+        return None
+    empty = MAX_HASH + 1
+    bins = [empty] * NUM_PERM
+    mask = NUM_PERM - 1
+    for shingle in shingle_set:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        value = (h >> BIN_BITS) & MAX_HASH
+        if value < bins[h & mask]:
+            bins[h & mask] = value
+    signature = array("I", [0]) * NUM_PERM
+    for i in range(NUM_PERM):
+        distance = 0
+        j = i
+        while bins[j] == empty:
+            j = (j + 1) & mask
+            distance += 1
+        signature[i] = (bins[j] + distance * ROTATION_OFFSET) & MAX_HASH
+    return signature
+
+
+def signature_for_pages(pages):
+    return minhash(shingles(slide_text(pages)))
+
+
+def similarity(sig_a, sig_b):
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / NUM_PERM
+
+
+# LSH index of published signatures. With 16 bands of 4 rows a pair at 0.6 Jaccard
+# becomes a candidate ~90% of the time; the signature estimate then decides.
+# Stored as an append-only binary file of [slug length][slug][signature] records;
+# the last record of a slug wins.
+class DuplicateIndex:
+    def __init__(self, path):
+        self.path = path
+        self.slugs = []
+        self.signatures = []
+        self.doc_by_slug = {}
+        self.buckets = [{} for _ in range(BANDS)]
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as file:
+            data = file.read()
+        pos = 0
+        while pos + RECORD_HEADER.size <= len(data):
+            (length,) = RECORD_HEADER.unpack_from(data, pos)
+            end = pos + RECORD_HEADER.size + length + SIGNATURE_BYTES
+            if end > len(data):
+                break
+            slug = data[pos + RECORD_HEADER.size:pos + RECORD_HEADER.size + length].decode("utf-8")
+            signature = array("I")
+            signature.frombytes(data[end - SIGNATURE_BYTES:end])
+            self._remember(slug, signature)
+            pos = end
+        truncate_torn_tail(self.path, pos)
+
+    def _band_keys(self, signature):
+        raw = signature.tobytes()
+        step = ROWS * 4
+        return [raw[i * step:(i + 1) * step] for i in range(BANDS)]
+
+    def _remember(self, slug, signature):
+        old = self.doc_by_slug.get(slug)
+        if old is not None:
+            for band, key in enumerate(self._band_keys(self.signatures[old])):
+                self.buckets[band][key].remove(old)
+            self.signatures[old] = signature
+            doc_id = old
+        else:
+            doc_id = len(self.slugs)
+            self.slugs.append(slug)
+            self.signatures.append(signature)
+            self.doc_by_slug[slug] = doc_id
+        for band, key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(key, []).append(doc_id)
+
+    def add(self, slug, signature):
+        if signature is None:
+            return
+        encoded = slug.encode("utf-8")
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "ab") as file:
+                file.write(RECORD_HEADER.pack(len(encoded)) + encoded + signature.tobytes())
+            self._remember(slug, signature)
+
+    # Published stories whose slide text is at least `threshold` similar, best first.
+    # `exclude` holds slugs that are the same story (an update, or its language variants).
+    def query(self, signature, threshold=DUPLICATE_THRESHOLD, exclude=()):
+        if signature is None:
+            return []
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates.update(self.buckets[band].get(key, ()))
+            matches = []
+            for doc_id in candidates:
+                slug = self.slugs[doc_id]
+                if slug in exclude:
+                    continue
+                score = similarity(signature, self.signatures[doc_id])
+                if score >= threshold:
+                    matches.append((slug, score))
+        matches.sort(key=lambda match: -match[1])
+        return matches
@@ -0,0 +1,172 @@
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("suvichaar.pipeline")
+if not logger.handlers:
+    # One JSON object per line on stderr, whatever Streamlit does with the root logger
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+# Process-wide per-stage aggregates, exported in Prometheus text format
+class StageMetrics:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def observe(self, pipeline, stage, seconds, nbytes=None):
+        with self._lock:
+            entry = self._stages.setdefault(
+                (pipeline, stage), {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0, "bytes": 0}
+            )
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["bytes"] += nbytes or 0
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP suvichaar_stage_duration_seconds Time spent in each pipeline stage.",
+            "# TYPE suvichaar_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for (pipeline, stage), entry in stages:
+                labels = f'pipeline="{pipeline}",stage="{stage}"'
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    lines.append(f'suvichaar_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'suvichaar_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+                lines.append(f"suvichaar_stage_duration_seconds_sum{{{labels}}} {entry['sum']:.6f}")
+                lines.append(f"suvichaar_stage_duration_seconds_count{{{labels}}} {entry['count']}")
+            lines.append("# HELP suvichaar_stage_bytes_total Bytes handled by each pipeline stage.")
+            lines.append("# TYPE suvichaar_stage_bytes_total counter")
+            for (pipeline, stage), entry in stages:
+                lines.append(f'suvichaar_stage_bytes_total{{pipeline="{pipeline}",stage="{stage}"}} {entry["bytes"]}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = StageMetrics()
+
+# tracemalloc is process-wide; it runs while at least one timer traces memory
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+
+def _acquire_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_users += 1
+
+
+def _release_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+# Named spans for one run of a pipeline (one submit, one metadata generation, ...).
+# With trace_memory, each span also records the peak Python heap growth since the
+# run started (peak_bytes). Spans must not nest then, and concurrent traced runs
+# share one tracer, so their peaks are only exact when runs do not overlap.
+class PipelineTimer:
+    def __init__(self, pipeline, metrics=METRICS, trace_memory=False):
+        self.pipeline = pipeline
+        self.metrics = metrics
+        self.spans = []
+        self.trace_memory = trace_memory
+        self.peak_bytes = 0
+        if trace_memory:
+            _acquire_tracing()
+            self._memory_base = tracemalloc.get_traced_memory()[0]
+        self._started = time.perf_counter()
+
+    # The yielded dict can be updated inside the block, e.g. span["bytes"] = len(body)
+    @contextmanager
+    def span(self, stage, nbytes=None):
+        record = {"stage": stage, "seconds": None, "bytes": nbytes}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 6)
+            if self.trace_memory:
+                record["peak_bytes"] = max(0, tracemalloc.get_traced_memory()[1] - self._memory_base)
+                self.peak_bytes = max(self.peak_bytes, record["peak_bytes"])
+            self.spans.append(record)
+            self.metrics.observe(self.pipeline, stage, record["seconds"], record["bytes"])
+
+    def __enter__(self):
+        return self
+
+    # Tracing is released even when the run stops early (a Streamlit rerun or
+    # stop raises through the block) and finish() is never reached
+    def __exit__(self, *exc):
+        self._stop_tracing()
+
+    def _stop_tracing(self):
+        if self.trace_memory:
+            self.trace_memory = False
+            _release_tracing()
+
+    @property
+    def total_seconds(self):
+        return round(time.perf_counter() - self._started, 6)
+
+    # Emit one structured log line for the whole run and return it
+    def finish(self, **context):
+        summary = {
+            "event": "pipeline_timing",
+            "pipeline": self.pipeline,
+            "total_seconds": self.total_seconds,
+            "spans": self.spans,
+            **context,
+        }
+        if self.trace_memory:
+            summary["peak_bytes"] = self.peak_bytes
+            self._stop_tracing()
+        logger.info(json.dumps(summary, ensure_ascii=False))
+        return summary
+
+
+def start_metrics_server(port, host="0.0.0.0", metrics=METRICS):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-endpoint").start()
+    return server
@@ -0,0 +1,209 @@
+import json
+import os
+import random
+import re
+import string
+import threading
+import unicodedata
+from urllib.parse import urlparse
+
+from append_log import read_json_lines
+
+NANO_ALPHABET = string.ascii_letters + string.digits + '_-'
+
+# Devanagari -> Latin, tuned for readable URL slugs rather than strict ISO 15919
+DEVANAGARI_VOWELS = {
+    "अ": "a", "आ": "a", "इ": "i", "ई": "i", "उ": "u", "ऊ": "u", "ऋ": "ri",
+    "ए": "e", "ऐ": "ai", "ओ": "o", "औ": "au", "ऑ": "o", "ॐ": "om",
+}
+DEVANAGARI_MATRAS = {
+    "ा": "a", "ि": "i", "ी": "i", "ु": "u", "ू": "u", "ृ": "ri",
+    "े": "e", "ै": "ai", "ो": "o", "ौ": "au", "ॉ": "o", "ॅ": "e",
+}
+DEVANAGARI_CONSONANTS = {
+    "क": "k", "ख": "kh", "ग": "g", "घ": "gh", "ङ": "n",
+    "च": "ch", "छ": "chh", "ज": "j", "झ": "jh", "ञ": "n",
+    "ट": "t", "ठ": "th", "ड": "d", "ढ": "dh", "ण": "n",
+    "त": "t", "थ": "th", "द": "d", "ध": "dh", "न": "n",
+    "प": "p", "फ": "ph", "ब": "b", "भ": "bh", "म": "m",
+    "य": "y", "र": "r", "ल": "l", "व": "v", "श": "sh",
+    "ष": "sh", "स": "s", "ह": "h", "ळ": "l",
+}
+DEVANAGARI_NUKTA = {"k": "q", "kh": "kh", "g": "g", "j": "z", "d": "r", "dh": "rh", "ph": "f"}
+DEVANAGARI_SIGNS = {"ं": "n", "ँ": "n", "ः": "h", "।": " ", "॥": " "}
+VIRAMA = "्"
+NUKTA = "़"
+
+
+def transliterate(text):
+    text = unicodedata.normalize("NFC", text)
+    # NFC keeps nukta letters decomposed (क़ -> क + ़)
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c in DEVANAGARI_CONSONANTS:
+            latin = DEVANAGARI_CONSONANTS[c]
+            if i + 1 < len(text) and text[i + 1] == NUKTA:
+                latin = DEVANAGARI_NUKTA.get(latin, latin)
+                i += 1
+            out.append(latin)
+            nxt = text[i + 1] if i + 1 < len(text) else ""
+            if nxt in DEVANAGARI_MATRAS:
+                out.append(DEVANAGARI_MATRAS[nxt])
+                i += 1
+            elif nxt == VIRAMA:
+                i += 1
+            elif nxt and (nxt in DEVANAGARI_CONSONANTS or nxt in DEVANAGARI_SIGNS):
+                # Inherent vowel; Hindi drops it at the end of a word
+                out.append("a")
+        elif c in DEVANAGARI_VOWELS:
+            out.append(DEVANAGARI_VOWELS[c])
+        elif c in DEVANAGARI_MATRAS:
+            out.append(DEVANAGARI_MATRAS[c])
+        elif c in DEVANAGARI_SIGNS:
+            out.append(DEVANAGARI_SIGNS[c])
+        elif "०" <= c <= "९":
+            out.append(str(ord(c) - ord("०")))
+        elif c not in (VIRAMA, NUKTA):
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+# URL slug for any title; non-Latin titles are transliterated instead of dropped
+def slugify(title, max_length=80):
+    text = unicodedata.normalize("NFKD", transliterate(title))
+    text = text.encode("ascii", "ignore").decode("ascii")
+    slug = re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+    if len(slug) > max_length:
+        slug = slug[:max_length].rsplit("-", 1)[0]
+    return slug or "story"
+
+
+# Local index of published stories.
+# Stored as append-only JSON lines; the last line written for a slug wins, so
+# an update is just another line and nothing is ever rewritten in place (until
+# compaction). Only the slug -> file offset of each story's latest line and the
+# uids are held in memory; full records are read from the file when asked for.
+# Allocated uids go to a side file of one uid per line, so a story that was
+# rendered but never published (or only bundled) keeps its uid out of
+# circulation without a full JSON line.
+COMPACT_MIN_DEAD = 1000
+
+
+class StoryIndex:
+    def __init__(self, path):
+        self.path = path
+        self.reserved_path = path + ".reserved"
+        self.offsets = {}
+        self.slug_by_uid = {}
+        self.reserved = set()
+        self.dead = 0
+        # Called with each recorded entry, after it is stored (e.g. the search index)
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._load()
+        if self.dead >= COMPACT_MIN_DEAD and self.dead > len(self.offsets):
+            self.compact()
+
+    def _load(self):
+        self.offsets.clear()
+        self.slug_by_uid.clear()
+        self.reserved.clear()
+        self.dead = 0
+        for offset, entry in read_json_lines(self.path, repair=True):
+            if entry.get("reserved"):
+                # Older files kept reservations inline
+                self.reserved.add(entry["uid"])
+                self.dead += 1
+            else:
+                if entry["slug_nano"] in self.offsets:
+                    self.dead += 1
+                self.offsets[entry["slug_nano"]] = offset
+                self.slug_by_uid[entry["uid"]] = entry["slug_nano"]
+        if os.path.exists(self.reserved_path):
+            with open(self.reserved_path, "r", encoding="utf-8") as file:
+                self.reserved.update(line.strip() for line in file if line.strip())
+        self.reserved.difference_update(self.slug_by_uid)
+
+    def _read_at(self, offset):
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return json.loads(file.readline())
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # Latest record of every story, streamed in file (publish/update) order
+    def entries(self):
+        latest = set(self.offsets.values())
+        for offset, entry in read_json_lines(self.path):
+            if offset in latest and not entry.get("reserved"):
+                yield entry
+
+    # Accepts a slug_nano, a story uid, or a full story / HTML URL
+    def get(self, slug_or_uid):
+        if not slug_or_uid:
+            return None
+        value = slug_or_uid.strip()
+        if "://" in value:
+            value = urlparse(value).path.rstrip("/").split("/")[-1]
+        if value.endswith(".html"):
+            value = value[: -len(".html")]
+        offset = self.offsets.get(value)
+        if offset is None:
+            offset = self.offsets.get(self.slug_by_uid.get(value))
+        return self._read_at(offset) if offset is not None else None
+
+    def _append(self, entry):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "ab") as file:
+            offset = file.tell()
+            file.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+        return offset
+
+    def record(self, entry):
+        with self._lock:
+            offset = self._append(entry)
+            if entry["slug_nano"] in self.offsets:
+                self.dead += 1
+            self.offsets[entry["slug_nano"]] = offset
+            self.slug_by_uid[entry["uid"]] = entry["slug_nano"]
+            self.reserved.discard(entry["uid"])
+        for listener in self.listeners:
+            listener(entry)
+        return entry
+
+    # Collision-checked uid: set lookups against every uid ever issued, no S3 HEAD calls
+    def allocate(self, title):
+        slug = slugify(title)
+        with self._lock:
+            while True:
+                nano = ''.join(random.choices(NANO_ALPHABET, k=10)) + '_G'
+                if nano not in self.slug_by_uid and nano not in self.reserved:
+                    break
+            directory = os.path.dirname(self.reserved_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.reserved_path, "a", encoding="utf-8") as file:
+                file.write(nano + "\n")
+            self.reserved.add(nano)
+        return nano, f"{slug}_{nano}"
+
+    # Rewrite the index with only the latest line per story, and the reservation
+    # file with only uids that were never published
+    def compact(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                for entry in self.entries():
+                    file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            reserved_tmp = self.reserved_path + ".tmp"
+            with open(reserved_tmp, "w", encoding="utf-8") as file:
+                file.writelines(uid + "\n" for uid in sorted(self.reserved))
+            os.replace(reserved_tmp, self.reserved_path)
+            os.replace(tmp_path, self.path)
+            self._load()
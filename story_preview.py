@@ -0,0 +1,94 @@
+import re
+
+PAGE_OPEN_RE = re.compile(rb"<amp-story-page\b[^>]*>", re.IGNORECASE)
+PAGE_ID_RE = re.compile(rb'\sid="([^"]*)"')
+PAGE_CLOSE = b"</amp-story-page>"
+STYLE_OPEN_RE = re.compile(rb"<style\b([^>]*)>", re.IGNORECASE)
+STYLE_CLOSE_RE = re.compile(rb"</style>", re.IGNORECASE)
+PREVIEW_CHARS = 20000
+
+
+def format_size(nbytes):
+    for unit in ("B", "KB", "MB"):
+        if nbytes < 1024 or unit == "MB":
+            return f"{nbytes:.0f} {unit}" if unit == "B" else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+
+
+# Byte offsets of every slide, and of the <style> blocks before the first slide,
+# in a rendered story (bytes). Built once per story so a preview only decodes
+# the slice it shows.
+def build_page_index(html):
+    pages = []
+    pos = 0
+    while True:
+        opening = PAGE_OPEN_RE.search(html, pos)
+        if not opening:
+            break
+        end = html.find(PAGE_CLOSE, opening.end())
+        if end == -1:
+            break
+        end += len(PAGE_CLOSE)
+        page_id = PAGE_ID_RE.search(opening.group(0))
+        pages.append({
+            "id": page_id.group(1).decode("utf-8", "replace") if page_id else f"page-{len(pages) + 1}",
+            "start": opening.start(),
+            "end": end,
+        })
+        pos = end
+
+    head_end = pages[0]["start"] if pages else len(html)
+    styles = []
+    pos = 0
+    while True:
+        opening = STYLE_OPEN_RE.search(html, pos, head_end)
+        if not opening:
+            break
+        closing = STYLE_CLOSE_RE.search(html, opening.end(), head_end)
+        if not closing:
+            break
+        styles.append({
+            "attrs": opening.group(1).decode("utf-8", "replace").strip(),
+            "start": opening.end(),
+            "end": closing.start(),
+        })
+        pos = closing.end()
+    return {"size": len(html), "head_end": head_end, "pages": pages, "styles": styles}
+
+
+# Decode at most `limit` bytes from a list of (start, end) ranges and literal notes.
+# Returns the text and whether anything was cut off.
+def _take(html, items, limit):
+    chunks = []
+    remaining = limit
+    for item in items:
+        if isinstance(item, str):
+            chunks.append(item)
+            continue
+        start, end = item
+        if remaining <= 0:
+            return "".join(chunks), True
+        cut = min(end, start + remaining)
+        chunks.append(html[start:cut].decode("utf-8", "ignore"))
+        remaining -= cut - start
+        if cut < end:
+            return "".join(chunks), True
+    return "".join(chunks), False
+
+
+# Everything before the first slide, with each <style> body collapsed to a size note
+def preview_head(html, index, limit=PREVIEW_CHARS):
+    items = []
+    last = 0
+    for style in index["styles"]:
+        items.append((last, style["start"]))
+        items.append(f"/* {style['attrs'] or 'style'}: {format_size(style['end'] - style['start'])} collapsed */")
+        last = style["end"]
+    items.append((last, index["head_end"]))
+    return _take(html, items, limit)
+
+
+# One slide by position (1-based), clipped to `limit` bytes
+def preview_page(html, index, number, limit=PREVIEW_CHARS):
+    page = index["pages"][number - 1]
+    return _take(html, [(page["start"], page["end"])], limit)
@@ -0,0 +1,172 @@
+import re
+import zipfile
+from io import BytesIO
+
+PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+# Split a template into literal text and placeholder names once.
+# Even positions are literal text, odd positions are placeholder names.
+def compile_template(template_text):
+    return PLACEHOLDER_RE.split(template_text)
+
+
+# Fill placeholders from a dict; unknown placeholders are left as-is
+def render_template(compiled, fields):
+    out = []
+    for i, part in enumerate(compiled):
+        if i % 2:
+            value = fields.get(part)
+            out.append("{{" + part + "}}" if value is None else value)
+        else:
+            out.append(part)
+    return "".join(out)
+
+
+# Names of the fields whose value differs from the previously published version.
+# A field the old version did not have counts as unchanged while it is empty.
+def changed_fields(old_fields, new_fields):
+    return sorted(k for k, v in new_fields.items() if old_fields.get(k, "") != v)
+
+
+STYLE_OPEN_RE = re.compile(r"<style\s+amp-custom[^>]*>", re.IGNORECASE)
+STYLE_CLOSE_RE = re.compile(r"</style>", re.IGNORECASE)
+STYLE_OPEN_BYTES_RE = re.compile(STYLE_OPEN_RE.pattern.encode(), re.IGNORECASE)
+STYLE_CLOSE_BYTES_RE = re.compile(STYLE_CLOSE_RE.pattern.encode(), re.IGNORECASE)
+AMP_IMG_BYTES_RE = re.compile(rb"<amp-img\b[^>]*>", re.IGNORECASE)
+AMP_STORY_OPEN_RE = re.compile(r"<amp-story\b[^>]*>")
+ANALYTICS_TAG = '<amp-story-auto-analytics gtag-id="G-2D5GXVRK1E" class="i-amphtml-layout-container" i-amphtml-layout="container"></amp-story-auto-analytics>'
+PAGE_START = "<amp-story-page"
+PAGE_END = "</amp-story-page>"
+PAGE_START_BYTES = PAGE_START.encode()
+PAGE_END_BYTES = PAGE_END.encode()
+ZIP_CHUNK = 1024 * 1024
+
+
+# Remove incorrect {url} wrapping left around href/src values
+def cleanup_wrapped_urls(html):
+    html = re.sub(r'href="\{(https://[^}]+)\}"', r'href="\1"', html)
+    return re.sub(r'src="\{(https://[^}]+)\}"', r'src="\1"', html)
+
+
+# <style amp-custom> block of the uploaded raw HTML, or "".
+# Raw bytes give back a memoryview into them instead of a copy.
+# The closing tag is searched from the opening one; a lazy .*? over a multi-MB
+# stylesheet would retry the match at every character.
+def extract_style(raw_html):
+    if isinstance(raw_html, str):
+        open_re, close_re, empty = STYLE_OPEN_RE, STYLE_CLOSE_RE, ""
+    else:
+        open_re, close_re, empty = STYLE_OPEN_BYTES_RE, STYLE_CLOSE_BYTES_RE, b""
+    opening = open_re.search(raw_html)
+    closing = opening and close_re.search(raw_html, opening.end())
+    if not closing:
+        return empty
+    if isinstance(raw_html, str):
+        return raw_html[opening.start():closing.end()]
+    return memoryview(raw_html)[opening.start():closing.end()]
+
+
+# Everything from the first <amp-story-page to the last </amp-story-page>, or "".
+# Raw bytes give back a memoryview into them instead of a copy.
+def extract_story_pages(raw_html):
+    if isinstance(raw_html, str):
+        start = raw_html.find(PAGE_START)
+        end = raw_html.rfind(PAGE_END)
+        if start == -1 or end == -1:
+            return ""
+        return raw_html[start:end + len(PAGE_END)]
+    start = raw_html.find(PAGE_START_BYTES)
+    end = raw_html.rfind(PAGE_END_BYTES)
+    if start == -1 or end == -1:
+        return b""
+    return memoryview(raw_html)[start:end + len(PAGE_END_BYTES)]
+
+
+# Split extracted slides (bytes) into untouched slices at even positions and decoded
+# <amp-img> tags at odd positions, so tag rewrites never copy the rest of the markup
+def split_img_tags(pages):
+    view = memoryview(pages)
+    segments = []
+    last = 0
+    for match in AMP_IMG_BYTES_RE.finditer(view):
+        segments.append(view[last:match.start()])
+        segments.append(str(match.group(0), "utf-8"))
+        last = match.end()
+    segments.append(view[last:])
+    return segments
+
+
+# Insert the extracted style before </head> and the slides right after <amp-story ...>,
+# without concatenating: returns the output as a list of parts (str, bytes or memoryview;
+# the slides may be a single part or a list of segments) and a list of warnings for
+# anything that could not be placed.
+def assemble_story_parts(html_template, extracted_style, extracted_amp_story):
+    warnings = []
+    inserts = []
+    if extracted_style:
+        head_close_pos = html_template.lower().find("</head>")
+        if head_close_pos != -1:
+            inserts.append((head_close_pos, ["\n", extracted_style, "\n"]))
+        else:
+            warnings.append("No </head> tag found in HTML template to insert <style amp-custom>.")
+
+    if extracted_amp_story:
+        amp_story_opening_match = AMP_STORY_OPEN_RE.search(html_template)
+        if amp_story_opening_match and ANALYTICS_TAG in html_template:
+            # Slides go just after the opening tag, before the analytics tag
+            if not isinstance(extracted_amp_story, list):
+                extracted_amp_story = [extracted_amp_story]
+            inserts.append((amp_story_opening_match.end(), ["\n\n", *extracted_amp_story, "\n\n"]))
+        else:
+            warnings.append("Could not find insertion points in the HTML template.")
+
+    parts = []
+    last = 0
+    for pos, inserted in sorted(inserts, key=lambda item: item[0]):
+        parts.append(html_template[last:pos])
+        parts.extend(inserted)
+        last = pos
+    parts.append(html_template[last:])
+    return parts, warnings
+
+
+# The whole document as one bytes object: str parts are encoded, byte slices copied
+# straight into the result, so the output is materialised exactly once
+def encode_parts(parts):
+    return b"".join(part.encode("utf-8") if isinstance(part, str) else part for part in parts)
+
+
+# <link rel="alternate" hreflang> tags for the language variants of one story,
+# given (lang, url) pairs; the first variant is the x-default. Empty for one variant.
+def hreflang_links(alternates):
+    if len(alternates) < 2:
+        return ""
+    links = [f'<link rel="alternate" hreflang="{lang}" href="{url}">' for lang, url in alternates]
+    links.append(f'<link rel="alternate" hreflang="x-default" href="{alternates[0][1]}">')
+    return "\n      ".join(links)
+
+
+# HTML + metadata bundle offered for download. Pass the already encoded HTML bytes;
+# entries are deflated (fastest level) so the bundle is a fraction of the output,
+# not a second copy.
+def build_story_zip(slug_nano, html, json_str):
+    return build_bundle_zip([(slug_nano, html, json_str)])
+
+
+# Same for several stories (e.g. the language variants of one submit) in one ZIP
+def build_bundle_zip(stories):
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+        for slug_nano, html, json_str in stories:
+            if isinstance(html, str):
+                zip_file.writestr(f"{slug_nano}.html", html)
+            else:
+                # Compressed 1 MB at a time, so no full-size compressed copy exists alongside
+                view = memoryview(html)
+                with zip_file.open(f"{slug_nano}.html", "w") as entry:
+                    for offset in range(0, len(view), ZIP_CHUNK):
+                        entry.write(view[offset:offset + ZIP_CHUNK])
+            zip_file.writestr(f"{slug_nano}_metadata.json", json_str)
+    zip_buffer.seek(0)
+    return zip_buffer
@@ -0,0 +1,269 @@
+import os
+import pickle
+import re
+import shlex
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from story_index import transliterate
+
+# Letters and digits plus the Devanagari block, so matras do not split words
+TOKEN_RE = re.compile(r"[\wऀ-ॿ]+")
+DEVANAGARI_RE = re.compile(r"[ऀ-ॿ]")
+FILTER_RE = re.compile(r"^(lang|cat|tag):(.+)$")
+MIN_PREFIX = 2
+PREFIX_TERMS = 200
+# A posting list holding more than 1/DENSE_RATIO of all docs is also kept as a
+# bitmap; the bitmap is then no bigger than the array it shadows
+DENSE_RATIO = 32
+SNAPSHOT_EVERY = 50
+EMPTY = array("I")
+
+
+def tokenize(text):
+    if not text:
+        return []
+    text = text.lower()
+    tokens = TOKEN_RE.findall(text)
+    if DEVANAGARI_RE.search(text):
+        # Also index the Latin spelling, so "lata" finds "लता"
+        tokens += TOKEN_RE.findall(transliterate(text))
+    return tokens
+
+
+# Searchable terms of one published story, from its metadata record. Filters are
+# indexed as terms too: lang:hi, cat:21, tag:music
+def story_terms(metadata):
+    tags = metadata.get("filterTags", [])
+    text = " ".join([
+        metadata.get("story_title", ""), metadata.get("keywords", ""), metadata.get("metadescription", ""), *tags
+    ])
+    terms = set(tokenize(text))
+    terms.update("tag:" + " ".join(tokenize(tag)) for tag in tags)
+    if metadata.get("lang"):
+        terms.add("lang:" + metadata["lang"].lower())
+    if metadata.get("categories") is not None:
+        terms.add(f"cat:{metadata['categories']}")
+    return terms
+
+
+# Query words, split shell-style so double quotes keep a phrase together
+# (tag:"indian railways"). Single quotes are left alone (apostrophes in titles),
+# and an unclosed quote while the user is still typing runs to the end.
+def query_words(query):
+    lexer = shlex.shlex(query, posix=True)
+    lexer.whitespace_split = True
+    lexer.quotes = '"'
+    lexer.escape = ""
+    try:
+        return list(lexer)
+    except ValueError:
+        return query_words(query + '"')
+
+
+def _contains(sorted_ids, doc_id):
+    i = bisect_left(sorted_ids, doc_id)
+    return i < len(sorted_ids) and sorted_ids[i] == doc_id
+
+
+def _to_bitmap(ids, size):
+    bits = bytearray((size + 7) // 8)
+    for doc_id in ids:
+        bits[doc_id >> 3] |= 1 << (doc_id & 7)
+    return int.from_bytes(bits, "little")
+
+
+# In-memory inverted index over the metadata of published stories, fed by the story
+# index's record() listener. Postings are arrays of doc ids in publish order; frequent
+# terms also get an int bitmap so AND-ing them is a handful of word operations. An
+# updated story gets a new doc id and its old one is tombstoned.
+#
+# With a snapshot path, the index is pickled after start-up and every SNAPSHOT_EVERY
+# publishes; at start-up only stories missing from (or changed since) the snapshot
+# are re-indexed. The story index stays the source of truth.
+class StorySearch:
+    def __init__(self, story_index=None, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self.docs = []
+        self.doc_by_slug = {}
+        self.dead = set()
+        self.dead_bits = 0
+        self.postings = {}
+        self.terms = []
+        self._bitmaps = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._unsaved = 0
+        self._catching_up = True
+        if snapshot_path and os.path.exists(snapshot_path):
+            self._load_snapshot()
+        if story_index is not None:
+            # Streamed in file order, which is publish/update order
+            for entry in story_index.entries():
+                doc_id = self.doc_by_slug.get(entry["slug_nano"])
+                if doc_id is None or self.docs[doc_id]["modifiedtime"] != entry.get("modifiedtime", ""):
+                    self.add(entry)
+            story_index.listeners.append(self.add)
+        self._catching_up = False
+        if self._unsaved:
+            self.save_snapshot()
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, "rb") as file:
+                state = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # A torn snapshot is only a cache; rebuild from the story index
+            return
+        self.docs = state["docs"]
+        self.doc_by_slug = state["doc_by_slug"]
+        self.dead = state["dead"]
+        self.postings = state["postings"]
+        self.terms = sorted(self.postings)
+        self.dead_bits = _to_bitmap(self.dead, len(self.docs))
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._save_lock:
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        with self._lock:
+            state = {
+                "docs": list(self.docs),
+                "doc_by_slug": dict(self.doc_by_slug),
+                "dead": set(self.dead),
+                "postings": {term: array("I", posting) for term, posting in self.postings.items()},
+            }
+            self._unsaved = 0
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def add(self, entry):
+        metadata = entry.get("metadata") or {}
+        doc = {
+            "slug_nano": entry["slug_nano"],
+            "title": metadata.get("story_title", ""),
+            "lang": metadata.get("lang", ""),
+            "category": metadata.get("categories"),
+            "tags": ", ".join(metadata.get("filterTags", [])),
+            "publishedtime": entry.get("publishedtime", ""),
+            "modifiedtime": entry.get("modifiedtime", ""),
+            "url": metadata.get("story_link", ""),
+        }
+        terms = story_terms(metadata)
+        with self._lock:
+            old = self.doc_by_slug.get(entry["slug_nano"])
+            if old is not None:
+                self.dead.add(old)
+                self.dead_bits |= 1 << old
+            doc_id = len(self.docs)
+            self.docs.append(doc)
+            self.doc_by_slug[entry["slug_nano"]] = doc_id
+            for term in terms:
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = array("I")
+                    insort(self.terms, term)
+                posting.append(doc_id)
+                if term in self._bitmaps:
+                    self._bitmaps[term] |= 1 << doc_id
+            self._unsaved += 1
+            snapshot_due = self.snapshot_path and not self._catching_up and self._unsaved >= SNAPSHOT_EVERY
+        if snapshot_due and not self._save_lock.locked():
+            threading.Thread(target=self.save_snapshot, daemon=True, name="search-snapshot").start()
+
+    # One term as a sorted id array (rare terms) or an int bitmap (frequent terms)
+    def _term_group(self, term):
+        posting = self.postings.get(term, EMPTY)
+        if len(posting) * DENSE_RATIO <= len(self.docs):
+            return posting
+        bitmap = self._bitmaps.get(term)
+        if bitmap is None:
+            bitmap = self._bitmaps[term] = _to_bitmap(posting, len(self.docs))
+        return bitmap
+
+    # Every term starting with the prefix (the first PREFIX_TERMS alphabetically), OR-ed
+    def _prefix_group(self, prefix):
+        start = bisect_left(self.terms, prefix)
+        sparse = []
+        bitmap = 0
+        for term in self.terms[start:start + PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            group = self._term_group(term)
+            if isinstance(group, int):
+                bitmap |= group
+            else:
+                sparse.append(group)
+        size = sum(len(posting) for posting in sparse)
+        if not bitmap and size * DENSE_RATIO <= len(self.docs):
+            return sorted(set().union(*sparse)) if len(sparse) > 1 else (sparse[0] if sparse else EMPTY)
+        for posting in sparse:
+            bitmap |= _to_bitmap(posting, len(self.docs))
+        return bitmap
+
+    # Every query word must match (AND). Words are exact terms, except the last one
+    # which also matches as a prefix while the user is still typing. lang:/cat:/tag:
+    # words filter. Newest matches first.
+    def search(self, query, limit=20):
+        started = time.perf_counter()
+        words = query_words(query.strip().lower())
+        partial = bool(words) and not query.endswith(" ")
+        with self._lock:
+            groups = []
+            for i, word in enumerate(words):
+                if FILTER_RE.match(word):
+                    if word.startswith("tag:"):
+                        word = "tag:" + " ".join(tokenize(word[4:]))
+                    groups.append(self._term_group(word))
+                    continue
+                last = partial and i == len(words) - 1
+                for token in tokenize(word):
+                    if last and len(token) >= MIN_PREFIX:
+                        groups.append(self._prefix_group(token))
+                    else:
+                        groups.append(self._term_group(token))
+            if not groups:
+                return {"results": [], "total": 0, "ms": 0.0}
+            results, total = self._intersect(groups, limit)
+        return {"results": results, "total": total, "ms": round((time.perf_counter() - started) * 1000, 3)}
+
+    def _intersect(self, groups, limit):
+        bitmaps = [group for group in groups if isinstance(group, int)]
+        sparse = sorted((group for group in groups if not isinstance(group, int)), key=len)
+        dense = None
+        if bitmaps:
+            dense = bitmaps[0]
+            for bitmap in bitmaps[1:]:
+                dense &= bitmap
+            dense &= ~self.dead_bits
+
+        if not sparse:
+            # Newest first: peel off the highest set bits
+            total = dense.bit_count()
+            results = []
+            while dense and len(results) < limit:
+                top = dense.bit_length() - 1
+                results.append(self.docs[top])
+                dense ^= 1 << top
+            return results, total
+
+        # Walk the shortest id list, binary-search the other lists, test the bitmap
+        candidates = sparse[0]
+        for group in sparse[1:]:
+            candidates = [doc_id for doc_id in candidates if _contains(group, doc_id)]
+        if dense is None:
+            candidates = [doc_id for doc_id in candidates if doc_id not in self.dead]
+        else:
+            bits = dense.to_bytes((len(self.docs) + 7) // 8, "little")
+            candidates = [doc_id for doc_id in candidates if bits[doc_id >> 3] >> (doc_id & 7) & 1]
+        return [self.docs[doc_id] for doc_id in reversed(candidates[-limit:])], len(candidates)
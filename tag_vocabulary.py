@@ -0,0 +1,107 @@
+import heapq
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+SPACE_RE = re.compile(r"\s+")
+WORD_START_RE = re.compile(r"\S+")
+# Completions for prefixes this short span most of the vocabulary, so they are cached
+CACHED_PREFIX = 2
+# LLM output often wraps tags in quotes or prefixes them with #
+TRIM_CHARS = " \"'#.;"
+
+
+def clean_tag(tag):
+    return SPACE_RE.sub(" ", unicodedata.normalize("NFKC", tag)).strip(TRIM_CHARS)
+
+
+# Case- and whitespace-insensitive key: "Indian  cinema" and "indian Cinema" are one tag
+def tag_key(tag):
+    return clean_tag(tag).casefold()
+
+
+# Filter tags used on published stories, by frequency. Every tag is kept under the
+# start of each of its words in one sorted array, so "cin" completes to "Indian
+# Cinema" with a bisect. The canonical spelling of a tag is its most used one.
+class TagVocabulary:
+    def __init__(self, story_index=None):
+        self.counts = {}
+        self.spellings = {}
+        self.words = []
+        self.tags_by_slug = {}
+        self._completions = {}
+        self._lock = threading.RLock()
+        self._loading = False
+        if story_index is not None:
+            # Bulk load: collect the words unsorted and sort once
+            self._loading = True
+            for entry in story_index.entries():
+                self.add_entry(entry)
+            self.words.sort()
+            self._loading = False
+            story_index.listeners.append(self.add_entry)
+
+    def _add(self, tag, delta):
+        spelling = clean_tag(tag)
+        key = spelling.casefold()
+        if not key:
+            return
+        spellings = self.spellings.setdefault(key, {})
+        spellings[spelling] = spellings.get(spelling, 0) + delta
+        if key not in self.counts:
+            self.counts[key] = 0
+            for match in WORD_START_RE.finditer(key):
+                if self._loading:
+                    self.words.append((key[match.start():], key))
+                else:
+                    insort(self.words, (key[match.start():], key))
+        self.counts[key] += delta
+        self._completions.clear()
+
+    # One published story (a story index record); re-publishing a slug replaces its tags
+    def add_entry(self, entry):
+        tags = {tag_key(tag): tag for tag in (entry.get("metadata") or {}).get("filterTags", [])}
+        with self._lock:
+            for tag in self.tags_by_slug.get(entry["slug_nano"], ()):
+                self._add(tag, -1)
+            for tag in tags.values():
+                self._add(tag, 1)
+            self.tags_by_slug[entry["slug_nano"]] = list(tags.values())
+
+    def canonical(self, tag):
+        key = tag_key(tag)
+        with self._lock:
+            spellings = self.spellings.get(key)
+            if not spellings or self.counts.get(key, 0) <= 0:
+                return clean_tag(tag)
+            return max(spellings.items(), key=lambda item: item[1])[0]
+
+    # Most used tags with a word starting with `prefix`, as (tag, count)
+    def complete(self, prefix, limit=8):
+        prefix = tag_key(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            cached = self._completions.get((prefix, limit))
+            if cached is not None:
+                return cached
+            start = bisect_left(self.words, (prefix,))
+            end = bisect_left(self.words, (prefix + "\U0010ffff",), start)
+            keys = {key for _, key in self.words[start:end] if self.counts[key] > 0}
+            best = heapq.nlargest(limit, keys, key=lambda key: (self.counts[key], key))
+            completions = [(self.canonical(key), self.counts[key]) for key in best]
+            if len(prefix) <= CACHED_PREFIX:
+                self._completions[(prefix, limit)] = completions
+            return completions
+
+    # Comma separated tags -> canonical spellings, duplicates dropped, order kept
+    def parse(self, text):
+        tags = []
+        seen = set()
+        for tag in text.split(","):
+            key = tag_key(tag)
+            if key and key not in seen:
+                seen.add(key)
+                tags.append(self.canonical(tag))
+        return tags
@@ -0,0 +1,88 @@
+import json
+import os
+import re
+
+from story_render import compile_template
+
+# Story page layouts composed from shared partials. A layout (templates/layouts/
+# <name>.html) pulls in partials (templates/partials/<name>.html) with {{> name}};
+# partials can include other partials. templates/layouts.json picks the layout
+# for a story by category and content type:
+#
+#   {"default": "story",
+#    "rules": [{"categories": ["Sports"], "content_type": ["News"], "layout": "scores"}]}
+#
+# The first rule whose listed fields all match wins; a rule without a field
+# matches any value of it. Every layout is composed and compiled once when the
+# registry is built, so a render is one render_template join over the parts.
+
+INCLUDE_RE = re.compile(r"\{\{>\s*(\w+)\s*\}\}")
+RULES_NAME = "layouts.json"
+DEFAULT_LAYOUT = "story"
+
+
+def _read_dir(directory):
+    texts = {}
+    if not os.path.isdir(directory):
+        return texts
+    for filename in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(filename)
+        if ext == ".html":
+            with open(os.path.join(directory, filename), "r", encoding="utf-8") as file:
+                texts[name] = file.read()
+    return texts
+
+
+# Expand {{> name}} includes; unknown and circular includes are errors
+def compose(text, partials, _stack=()):
+    def include(match):
+        name = match.group(1)
+        if name in _stack:
+            raise ValueError(f"Template partial '{name}' includes itself ({' > '.join(_stack + (name,))})")
+        if name not in partials:
+            raise ValueError(f"Unknown template partial '{name}'")
+        return compose(partials[name], partials, _stack + (name,))
+
+    return INCLUDE_RE.sub(include, text)
+
+
+class TemplateRegistry:
+    def __init__(self, directory="templates"):
+        self.directory = directory
+        # A partial's final newline belongs to the file, not to the markup
+        partials = {name: text[:-1] if text.endswith("\n") else text for name, text in _read_dir(os.path.join(directory, "partials")).items()}
+        layouts = _read_dir(os.path.join(directory, "layouts"))
+
+        rules_path = os.path.join(directory, RULES_NAME)
+        config = {}
+        if os.path.exists(rules_path):
+            with open(rules_path, "r", encoding="utf-8") as file:
+                config = json.load(file)
+        self.default = config.get("default", DEFAULT_LAYOUT)
+        self.rules = config.get("rules", [])
+        for rule in self.rules:
+            if rule.get("layout") not in layouts:
+                raise ValueError(f"Layout rule {rule} names an unknown layout")
+        if self.default not in layouts:
+            raise ValueError(f"Default layout '{self.default}' not found in {os.path.join(directory, 'layouts')}")
+
+        # Composed size in UTF-8 bytes and compiled template per layout
+        self.sizes = {}
+        self.compiled = {}
+        for name, text in layouts.items():
+            html = compose(text, partials)
+            self.sizes[name] = len(html.encode("utf-8"))
+            self.compiled[name] = compile_template(html)
+
+    # Layout name for a story; values are compared as given in the form
+    def select(self, categories=None, content_type=None):
+        story = {"categories": categories, "content_type": content_type}
+        for rule in self.rules:
+            if all(story[field] in rule[field] for field in ("categories", "content_type") if field in rule):
+                return rule["layout"]
+        return self.default
+
+    # (layout name, compiled template) for a story
+    def compiled_for(self, categories=None, content_type=None):
+        name = self.select(categories, content_type)
+        return name, self.compiled[name]
@@ -0,0 +1,58 @@
+import mmap
+import os
+import shutil
+import tempfile
+import weakref
+
+SPILL_THRESHOLD = 1024 * 1024
+COPY_CHUNK = 1024 * 1024
+
+
+def _release(data, path):
+    try:
+        data.close()
+    except BufferError:
+        # A memoryview into the map is still alive; the mapping goes with it
+        pass
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+# An upload written once to a temp file and exposed as a read-only mmap (`data`).
+# The file is removed on close(), when the object is garbage collected (e.g. with
+# the Streamlit session that holds it) or at interpreter exit.
+class SpilledFile:
+    def __init__(self, fileobj, directory=None, file_id=None):
+        self.file_id = file_id
+        fd, self.path = tempfile.mkstemp(prefix="story-upload-", suffix=".html", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(fileobj, out, COPY_CHUNK)
+            with open(self.path, "rb") as file:
+                self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            os.unlink(self.path)
+            raise
+        self._finalizer = weakref.finalize(self, _release, self.data, self.path)
+
+    def close(self):
+        self._finalizer()
+
+
+# Raw bytes of a Streamlit upload: small files as-is, larger ones spilled to disk
+# once per upload and returned as a read-only mmap. The spill is kept in
+# `session_state[slot]` (one slot per uploader) so reruns reuse it and it is
+# cleaned up with the session.
+def read_upload(uploaded_file, session_state, threshold=SPILL_THRESHOLD, directory=None, slot="spilled_upload"):
+    if uploaded_file.size <= threshold:
+        return uploaded_file.getvalue()
+    spilled = session_state.get(slot)
+    if spilled is None or spilled.file_id != uploaded_file.file_id:
+        if spilled is not None:
+            spilled.close()
+        uploaded_file.seek(0)
+        spilled = SpilledFile(uploaded_file, directory, uploaded_file.file_id)
+        session_state[slot] = spilled
+    return spilled.data